@@ -102,12 +102,12 @@ class AppRegister:
     ) -> List[List[Document]]:
         res = []
         for db in self.database:
-            for i in range(len(query)):
-                recall_res = db.search_by_embed(
-                    query_embed=query_embd[i],
-                    k=retrieve_top_k,
-                    store_name=store_name,
-                )
+            recall_batch = db.search_by_embeds(
+                query_embeds=query_embd,
+                k=retrieve_top_k,
+                store_name=store_name,
+            )
+            for i, recall_res in enumerate(recall_batch):
                 RagLogger().get_logger().info(
                     f"query {query[i]} recall_res: {recall_res}"
                 )
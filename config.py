@@ -1,7 +1,7 @@
 from loader import TextLoader
 from splitter import CharacterSplitter, RecursiveSplitter
 from embedding import BertEmbedding, BgeEmbedding
-from store import AnnStore
+from store import AnnStore, ShardedAnnStore
 from websearch import ArxivCallback, BaiduCallback
 from rerank import BgeNormalReranker
 from prompt_gen import BasePromptGen
@@ -14,7 +14,7 @@ SPLITTER = {"character": CharacterSplitter, "recursive": RecursiveSplitter}
 
 EMBEDDING = {"bert": BertEmbedding, "bge": BgeEmbedding}
 
-STORE = {"ann": AnnStore}
+STORE = {"ann": AnnStore, "sharded_ann": ShardedAnnStore}
 
 WEBSEARCH = {"arxiv": ArxivCallback, "baidu": BaiduCallback}
 
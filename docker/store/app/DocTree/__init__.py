@@ -1,2 +0,0 @@
-from .DocNode import DocNode
-from .DocTree import DocTree
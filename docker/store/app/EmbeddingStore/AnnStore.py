@@ -1,14 +1,108 @@
-from typing import List
+from typing import List, Dict, Tuple, NamedTuple
 import os
+import json
+import shutil
+import tarfile
+import tempfile
+import threading
 import numpy as np
-from annoy import AnnoyIndex
 from scipy.spatial.distance import cosine
 
 from .Store import Store
+from .EmbeddingMatrix import EmbeddingMatrix, file_lock, replacing
+from .IndexBackend import IndexBackend, distances
+from .AnnoyBackend import AnnoyBackend
+from .IvfBackend import IvfBackend
+from .IvfPqBackend import IvfPqBackend
+from .IvfSqBackend import IvfSqBackend
+from .IndexBuilder import IndexBuilder
+from .ResultCache import ResultCache
 from SqlConnector import SqliteConnector
 
 
+class StoreSnapshot(NamedTuple):
+    """
+    What a search needs from a store, published as a whole by every write.
+
+    A snapshot is never changed once published: searches take the current
+    one without a lock and keep using it, while writers build the next one.
+    Rows below ``size`` never change, so new chunks appended to the matrix
+    are simply not seen, and the index of a snapshot is not touched by
+    compactions, which publish a new index instead.
+    """
+
+    version: int
+    index: IndexBackend | None
+    tombstones: frozenset
+    matrix: EmbeddingMatrix
+    norms: np.ndarray
+    delta_start: int
+    size: int
+
+
+def _pack_strings(strings: List[str]) -> Dict[str, np.ndarray]:
+    """Strings as one UTF-8 buffer and the offsets of every string in it."""
+    encoded = [(string or "").encode("utf-8") for string in strings]
+    return {
+        "offsets": np.cumsum([0] + [len(string) for string in encoded]),
+        "data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "null": np.array([string is None for string in strings], dtype=bool),
+    }
+
+
+def _unpack_strings(
+    offsets: np.ndarray, data: np.ndarray, null: np.ndarray
+) -> List[str]:
+    data = data.tobytes()
+    return [
+        None if is_null else data[start:stop].decode("utf-8")
+        for start, stop, is_null in zip(offsets[:-1], offsets[1:], null)
+    ]
+
+
+class SearchHit(NamedTuple):
+    """
+    A search result: the chunk that was hit, merged with its neighbours.
+
+    ``chunk_ids`` are the merged chunks in document order, the hit chunk
+    among them. ``score`` is the cosine similarity and ``distance`` the
+    exact ``dis_type`` distance between the query and the hit chunk. Hits of
+    hybrid searches also have the ``rrf_score`` they were ranked by, and the
+    ``bm25_score`` of the hit chunk if the full-text search found it.
+    """
+
+    chunk_id: int
+    chunk_ids: List[int]
+    doc_id: int
+    text: str
+    score: float = None
+    distance: float = None
+    rrf_score: float = None
+    bm25_score: float = None
+
+
 class AnnoyStore(Store):
+    # Bumped whenever the layout of the archives written by
+    # ``export_snapshot`` changes.
+    # 1: documents, chunks, embedding matrix, tombstones and index
+    # 2: chunks carry ``dup_of``, linked duplicates have no matrix row
+    SNAPSHOT_FORMAT = 2
+    SNAPSHOT_FILES = (
+        "manifest.json",
+        "documents.npz",
+        "chunks.npz",
+        "matrix_ids.npy",
+        "embeddings.npy",
+        "tombstones.npy",
+        "index",
+    )
+
+    BACKENDS = {
+        "annoy": AnnoyBackend,
+        "ivf": IvfBackend,
+        "ivfpq": IvfPqBackend,
+        "ivfsq": IvfSqBackend,
+    }
 
     def __init__(
         self,
@@ -17,13 +111,38 @@ class AnnoyStore(Store):
         dis_type: str = "angular",
         emb_len: int = 1024,
         store_name: str = "store",
+        n_trees: int = 10,
+        max_delta_size: int = 1000,
+        max_tombstones: int = 1000,
+        max_dead_fraction: float = 0.25,
+        emb_dtype: str = "float32",
+        merge_mode: str = "greedy",
+        max_window: int = 5,
+        exact_threshold: int = 20000,
+        index_type: str = "annoy",
+        nlist: int = None,
+        nprobe: int = 8,
+        pq_m: int = None,
+        rerank: int = 4,
+        build_delay: float = 0.5,
+        dedup: str = "link",
+        result_cache: ResultCache = None,
     ):
+        if self._initialized:
+            return
         super().__init__(index_path, store_name)
+        assert (
+            index_type in self.BACKENDS
+        ), f"index_type must be one of {list(self.BACKENDS)}"
+        self.index_type = index_type
         self.index_path = (
             index_path
             if index_path
             else os.path.join(
-                os.path.dirname(__file__), "..", "data", self.store_name + ".ann"
+                os.path.dirname(__file__),
+                "..",
+                "data",
+                self.store_name + self.BACKENDS[index_type].suffix,
             )
         )
         self.db_path = (
@@ -35,49 +154,463 @@ class AnnoyStore(Store):
         )
         self.dis_type = dis_type
         self.emb_len = emb_len
+        self.emb_dtype = emb_dtype
+        self.n_trees = n_trees
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.rerank = rerank
+        assert dedup in ("link", "skip"), "dedup must be link or skip"
+        self.dedup = dedup
+        self.result_cache = result_cache
+        self.max_delta_size = max_delta_size
+        self.max_tombstones = max_tombstones
+        self.max_dead_fraction = max_dead_fraction
+        assert merge_mode in ("greedy", "window"), "merge_mode must be greedy or window"
+        self.merge_mode = merge_mode
+        self.max_window = max_window
+        self.exact_threshold = exact_threshold
+        self.tombstone_path = os.path.splitext(self.index_path)[0] + ".tomb.npy"
+        self.matrix_path = os.path.splitext(self.db_path)[0] + ".emb.npy"
+        self.version_path = os.path.splitext(self.index_path)[0] + ".version"
+        self.version_lock_path = self.version_path + ".lock"
+
+        # The store is split into two segments: the immutable main segment is
+        # the vector index on disk, and the delta segment holds the chunks added
+        # after the last build and is searched exactly. Chunk ids are
+        # AUTOINCREMENT, so every chunk with an id above ``main_max_id`` belongs
+        # to the delta segment, which is the tail of the embedding matrix.
+        # Deleted chunks that are still in the main segment are kept as
+        # tombstones and filtered out of every search until the next compaction
+        # drops them.
+        #
+        # Stores with at most ``exact_threshold`` live chunks build no vector
+        # index at all: the whole matrix is the delta and every search is an
+        # exact scan. Compaction switches between both modes as stores grow
+        # or shrink past the threshold.
+        #
+        # Deleted chunks keep their row in the matrix until a compaction finds
+        # that more than ``max_dead_fraction`` of the rows are dead and writes
+        # a new matrix without the rows the new main segment no longer needs.
+        #
+        # Everything is kept in memory between searches. Every write bumps the
+        # version on disk, and the segments are only reloaded once it differs
+        # from ``version``, e.g. after another worker process wrote the store.
+        #
+        # ``self.lock`` is only taken by writers, searches run on the
+        # ``snapshot`` published by the last write, so they never wait for
+        # each other and only wait for a writer while the store is reloaded.
+        self.index = None
+        self.main_max_id = -1
+        self.tombstones = set()
+        self.matrix = None
+        self.norms = np.empty(0, dtype=np.float32)
+        self.version = 0
+        self.snapshot = None
+        self.build_lock = threading.Lock()
+        self.builder = IndexBuilder(self.compact, build_delay)
 
-    def _load(self) -> None:
+    def _connector(self) -> SqliteConnector:
+        return SqliteConnector(self.db_path, self.emb_dtype)
+
+    def _new_index(self) -> IndexBackend:
+        args = (self.emb_len, self.dis_type, self.matrix)
+        if self.index_type == "ivfpq":
+            return IvfPqBackend(
+                *args, self.nlist, self.nprobe, m=self.pq_m, rerank=self.rerank
+            )
+        if self.index_type == "ivfsq":
+            return IvfSqBackend(*args, self.nlist, self.nprobe, rerank=self.rerank)
+        if self.index_type == "ivf":
+            return IvfBackend(*args, self.nlist, self.nprobe)
+        return AnnoyBackend(*args, self.n_trees, rerank=self.rerank)
+
+    @property
+    def loaded(self) -> bool:
+        return self.snapshot is not None
+
+    def _load(self) -> StoreSnapshot:
+        """Load the store if it is not loaded or outdated, and return its snapshot."""
+        version = self._read_version()
+        snapshot = self.snapshot
+        if snapshot is not None and version == snapshot.version:
+            return snapshot
         with self.lock:
-            self.index = AnnoyIndex(self.emb_len, self.dis_type)
-            if os.path.exists(self.index_path):
-                self.index.load(self.index_path)
-            else:
+            if self.snapshot is not None and version == self.snapshot.version:
+                return self.snapshot
+            self._read_segments()
+            self._sync_matrix()
+            self.version = version
+            self._publish()
+            return self.snapshot
+
+    def unload(self) -> bool:
+        """
+        Drop everything the store keeps in memory between searches and close
+        its database connections, the next call loads it again. Stores that
+        are compacting are left loaded.
+        """
+        if self.builder.busy or not self.build_lock.acquire(blocking=False):
+            return False
+        try:
+            with self.lock:
                 self.index = None
+                self.main_max_id = -1
+                self.tombstones = set()
+                self.matrix = None
+                self.norms = np.empty(0, dtype=np.float32)
+                self.snapshot = None
+                SqliteConnector.close(self.db_path)
+        finally:
+            self.build_lock.release()
+        return True
 
-    def _merge_chunk(self, chunk_id: int, query_embd: List[float]) -> str:
-        connector = SqliteConnector(self.db_path)
-        doc_id = connector.get_doc_id_by_chunk_id(chunk_id)
-        tree = connector.read_tree(doc_id)
+    def memory_usage(self) -> int:
+        """Bytes held or mapped by the loaded segments."""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return 0
+        usage = snapshot.norms.nbytes + snapshot.matrix.nbytes
+        if snapshot.index is not None:
+            usage += snapshot.index.nbytes
+        return usage
 
-        current_emb = np.array(connector.get_embedding_by_chunk_id(chunk_id))
-        current_dis = cosine(query_embd, current_emb)
-        query_embd = np.array(query_embd)
+    def _read_version(self) -> int:
+        try:
+            with open(self.version_path) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
 
-        res = connector.get_content_by_chunk_id(chunk_id)
-        can_merge = True
-        min_index = connector.get_index_by_chunk_id(chunk_id)
-        max_index = min_index
+    def _bump_version(self) -> None:
+        """Publish a write, must be called with ``self.lock`` held."""
+        # Other processes bump the same file, every write gets its own version
+        # so that each of them reloads.
+        with file_lock(self.version_lock_path):
+            version = max(self._read_version(), self.version) + 1
+            with replacing(self.version_path) as tmp_path, open(tmp_path, "w") as f:
+                f.write(str(version))
+        self.version = version
+        self._publish()
 
-        while can_merge:
-            min_node = tree.find_by_index(min_index)
-            max_node = tree.find_by_index(max_index)
-            predecessor_node = (
-                tree.get_predecessor(min_node) if min_node is not None else None
+    def _publish(self) -> None:
+        """Replace the snapshot searches run on, must be called with ``self.lock`` held."""
+        self.snapshot = StoreSnapshot(
+            version=self.version,
+            index=self.index,
+            tombstones=frozenset(self.tombstones),
+            matrix=self.matrix,
+            norms=self.norms,
+            delta_start=self._delta_start(),
+            size=len(self.matrix),
+        )
+
+    def _set_main(self, index: IndexBackend | None) -> None:
+        self.index = index
+        self.main_max_id = index.max_id if index is not None else -1
+        self.tombstones = {id for id in self.tombstones if id <= self.main_max_id}
+
+    def _load_tombstones(self) -> None:
+        self.tombstones = set()
+        if os.path.exists(self.tombstone_path):
+            self.tombstones = set(np.load(self.tombstone_path).tolist())
+
+    def _save_tombstones(self, tombstones: set) -> None:
+        with replacing(self.tombstone_path) as tmp_path, open(tmp_path, "wb") as f:
+            np.save(f, np.array(sorted(tombstones), dtype=np.int64))
+
+    def _read_segments(self) -> None:
+        """
+        Map the matrix and read the main index and its tombstones as written
+        by the last compaction, must be called with ``self.lock`` held.
+        """
+        if self.matrix is None or self.matrix.replaced:
+            # Rows only keep their position if the files grew, another
+            # process compacted them otherwise.
+            matrix = EmbeddingMatrix(self.matrix_path, self.emb_len)
+            if self.matrix is None or not matrix.extends(self.matrix):
+                self.norms = np.empty(0, dtype=np.float32)
+            self.matrix = matrix
+        else:
+            self.matrix.refresh()
+        index = None
+        if os.path.exists(self.index_path):
+            index = self._new_index()
+            index.load(self.index_path)
+        self._load_tombstones()
+        self._set_main(index)
+
+    def _sync_matrix(self) -> None:
+        """
+        Append the chunks written to SQLite since the last sync, and extend the
+        row norms used by the exact scan. Rows never change once written, so
+        only the norms of new rows are computed.
+        """
+        ids, embs = self._connector().get_emb_matrix(self.matrix.last_id)
+        if len(ids) and not self.matrix.append(ids, embs):
+            # Another process compacted the files, and replaced the index.
+            self._read_segments()
+            ids, embs = self._connector().get_emb_matrix(self.matrix.last_id)
+            if len(ids):
+                self.matrix.append(ids, embs)
+        _, data = self.matrix.items()
+        if len(self.norms) < len(data):
+            self.norms = np.concatenate(
+                [self.norms, np.linalg.norm(data[len(self.norms) :], axis=1)]
+            )
+
+    def _delta_start(self) -> int:
+        """First matrix row of the delta segment."""
+        return int(np.searchsorted(self.matrix.keys, self.main_max_id, side="right"))
+
+    def _live_count(self) -> int:
+        row_ids, _ = self.matrix.items()
+        return int(np.count_nonzero(row_ids > 0))
+
+    def _too_many_dead(self) -> bool:
+        return len(self.matrix) - self._live_count() > self.max_dead_fraction * len(
+            self.matrix
+        )
+
+    def _compact_matrix(self) -> None:
+        """
+        Drop the rows of deleted chunks from the matrix once there are too
+        many, the tombstones of the main segment keep their rows since the
+        index can still return them. Must be called with ``self.lock`` held,
+        after the new main segment is set.
+        """
+        if not self._too_many_dead():
+            return
+        row_ids, _ = self.matrix.items()
+        row_ids = np.asarray(row_ids)
+        keep = (row_ids > 0) | np.isin(-row_ids, list(self.tombstones))
+        matrix = self.matrix.compact(keep)
+        if matrix is self.matrix:
+            return
+        self.matrix = matrix
+        self.norms = self.norms[: len(keep)][keep]
+        if self.index is not None:
+            self.index.matrix = matrix
+
+    def _scan(
+        self, snapshot: StoreSnapshot, query_embs: np.ndarray, start: int, stop: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Exact distances between every query and the matrix rows in
+        ``[start, stop)``, with the same definition Annoy uses for
+        ``dis_type``. The rows are read straight from the mapping and scaled by
+        their cached norms, which equals a product with the normalized matrix.
+        Deleted chunks get an infinite distance.
+        """
+        row_ids, data = snapshot.matrix.items()
+        row_ids, data = row_ids[start:stop], data[start:stop]
+        dis = distances(query_embs, data, self.dis_type, snapshot.norms[start:stop])
+        dis[:, row_ids <= 0] = np.inf
+        return np.asarray(row_ids), dis
+
+    def _load_docs(
+        self, snapshot: StoreSnapshot, chunk_ids: List[int]
+    ) -> Dict[int, Dict]:
+        """
+        Load every document hit by ``chunk_ids`` once: its chunk ids, in-doc
+        indices and contents ordered by index, and their embeddings.
+
+        Returns a mapping from each chunk id to its document, chunk ids whose
+        chunk no longer exists are left out. Chunks committed to SQLite after
+        the snapshot was published are not part of it and are left out too.
+        Linked duplicates are part of their document with the embedding of the
+        chunk they link to.
+        """
+        connector = self._connector()
+        doc_ids = connector.get_doc_ids_by_chunk_ids(chunk_ids)
+        docs = {}
+        for doc_id in set(doc_ids.values()):
+            ids, indices, contents, emb_ids = connector.get_doc_chunks(doc_id)
+            rows = snapshot.matrix.rows(emb_ids)
+            visible = [i for i, row in enumerate(rows) if 0 <= row < snapshot.size]
+            if len(visible) < len(ids):
+                ids = [ids[i] for i in visible]
+                indices = [indices[i] for i in visible]
+                contents = [contents[i] for i in visible]
+                emb_ids = [emb_ids[i] for i in visible]
+            docs[doc_id] = {
+                "doc_id": doc_id,
+                "ids": ids,
+                "indices": indices,
+                "contents": contents,
+                "embs": snapshot.matrix.get(emb_ids),
+                "pos": {id: i for i, id in enumerate(ids)},
+            }
+        return {
+            chunk_id: docs[doc_id]
+            for chunk_id, doc_id in doc_ids.items()
+            if chunk_id in docs[doc_id]["pos"]
+        }
+
+    def _merge_chunks(
+        self,
+        snapshot: StoreSnapshot,
+        hit_lists: List[List[int]],
+        query_embs: np.ndarray,
+    ) -> Tuple[List[List[SearchHit]], List[np.ndarray]]:
+        """
+        Merge the hits of several queries in one pass, each document touched by
+        any of the queries is loaded once. Returns the merged hits of every
+        query and the embeddings of their chunks.
+
+        Hits whose chunk no longer exists are left out.
+        """
+        docs = self._load_docs(
+            snapshot, [chunk_id for hits in hit_lists for chunk_id in hits]
+        )
+        hits = [
+            (i, chunk_id)
+            for i, chunk_ids in enumerate(hit_lists)
+            for chunk_id in chunk_ids
+            if chunk_id in docs
+        ]
+        if self.merge_mode == "window":
+            spans = self._merge_windows(
+                [chunk_id for _, chunk_id in hits],
+                docs,
+                query_embs[[i for i, _ in hits]],
             )
-            successor_node = (
-                tree.get_successor(max_node) if max_node is not None else None
+        else:
+            spans = [
+                self._merge_chunk(
+                    docs[chunk_id], docs[chunk_id]["pos"][chunk_id], query_embs[i]
+                )
+                for i, chunk_id in hits
+            ]
+        res = [[] for _ in hit_lists]
+        embs = [[] for _ in hit_lists]
+        for (i, chunk_id), (start, stop) in zip(hits, spans):
+            doc = docs[chunk_id]
+            embs[i].append(doc["embs"][doc["pos"][chunk_id]])
+            res[i].append(
+                SearchHit(
+                    chunk_id=chunk_id,
+                    chunk_ids=doc["ids"][start:stop],
+                    doc_id=doc["doc_id"],
+                    text="\n".join(doc["contents"][start:stop]),
+                )
             )
+        embs = [
+            np.array(hit_embs, dtype=np.float32).reshape(-1, self.emb_len)
+            for hit_embs in embs
+        ]
+        return res, embs
+
+    def _merge_windows(
+        self, chunk_ids: List[int], docs: Dict[int, Dict], query_embs: np.ndarray
+    ) -> List[Tuple[int, int]]:
+        """
+        Expand every hit to the contiguous window of at most ``max_window``
+        chunks around it whose mean embedding is closest to the query of that
+        hit, ``query_embs[i]`` for ``chunk_ids[i]``. Returns the ``[start,
+        stop)`` positions of every window in its document.
 
-            predecessor_emb = (
-                np.array(connector.get_embedding_by_chunk_id(predecessor_node.id))
-                if predecessor_node is not None
-                else None
+        The cosine distance of a window's sum equals that of its mean, and
+        only needs scalars: the product of the sum with the query is a
+        difference of prefix sums of the chunk products with the query, and
+        its squared norm adds up the products between chunks of the window.
+        Both are accumulated in float64 for every candidate window of every
+        hit at once, without materializing the window sums.
+        """
+        if not chunk_ids:
+            return []
+        w = self.max_window
+        doc_list = list({docs[c]["doc_id"]: docs[c] for c in chunk_ids}.values())
+        starts = np.cumsum([0] + [len(doc["ids"]) for doc in doc_list])
+        doc_start = {doc["doc_id"]: start for doc, start in zip(doc_list, starts)}
+        embs = np.concatenate([doc["embs"] for doc in doc_list])
+
+        lower = np.array([doc_start[docs[c]["doc_id"]] for c in chunk_ids])
+        hits = lower + np.array([docs[c]["pos"][c] for c in chunk_ids])
+        upper = lower + np.array([len(docs[c]["ids"]) for c in chunk_ids])
+
+        # Products of every hit's query with the chunks at offsets -(w - 1)
+        # to w - 1 around the hit, and their prefix sums along the offsets.
+        offsets = np.arange(1 - w, w)
+        pos = hits[:, None] + offsets[None, :]
+        inside = (pos >= lower[:, None]) & (pos < upper[:, None])
+        pos = np.where(inside, pos, hits[:, None])
+        dots = np.zeros((len(hits), len(offsets) + 1))
+        for j in range(len(offsets)):
+            dots[:, j + 1] = np.einsum(
+                "hd,hd->h", embs[pos[:, j]], query_embs, dtype=np.float64
             )
-            successor_emb = (
-                np.array(connector.get_embedding_by_chunk_id(successor_node.id))
-                if successor_node is not None
-                else None
+        dots[:, 1:][~inside] = 0.0
+        np.cumsum(dots, axis=1, out=dots)
+
+        # Prefix sums of the products between chunks ``k`` apart.
+        bands = [
+            np.concatenate(
+                [
+                    [0.0],
+                    np.cumsum(
+                        np.einsum(
+                            "nd,nd->n",
+                            embs[: len(embs) - k],
+                            embs[k:],
+                            dtype=np.float64,
+                        )
+                    ),
+                ]
             )
+            for k in range(min(w, len(embs)))
+        ]
+
+        # (left, right) extents of every window, shortest windows first so that
+        # ties keep the smaller window.
+        extents = sorted(
+            ((left, right) for left in range(w) for right in range(w - left)),
+            key=sum,
+        )
+        lefts = np.array([e[0] for e in extents])
+        rights = np.array([e[1] for e in extents])
+        left = hits[:, None] - lefts[None, :]
+        right = hits[:, None] + rights[None, :]
+        valid = (left >= lower[:, None]) & (right < upper[:, None])
+        left = np.where(valid, left, hits[:, None])
+        right = np.where(valid, right, hits[:, None])
+
+        window_dots = dots[:, w + rights] - dots[:, w - 1 - lefts]
+        sq_norms = np.zeros(left.shape)
+        for k, band in enumerate(bands):
+            # Products of the chunk pairs ``k`` apart in ``[left, right]``.
+            stop = np.where(right - k >= left, right - k + 1, left)
+            stop = np.minimum(stop, len(band) - 1)
+            sq_norms += (1.0 if k == 0 else 2.0) * (
+                band[stop] - band[np.minimum(left, len(band) - 1)]
+            )
+        norms = (
+            np.sqrt(np.maximum(sq_norms, 0.0))
+            * np.linalg.norm(query_embs.astype(np.float64), axis=1)[:, None]
+        )
+        dis = 1.0 - window_dots / np.maximum(norms, 1e-12)
+        dis[~valid] = np.inf
+        best = np.argmin(dis, axis=1)
+
+        rows = np.arange(len(chunk_ids))
+        starts = left[rows, best] - lower
+        stops = right[rows, best] - lower + 1
+        return list(zip(starts.tolist(), stops.tolist()))
+
+    def _merge_chunk(
+        self, doc: Dict, pos: int, query_embd: np.ndarray
+    ) -> Tuple[int, int]:
+        embs = doc["embs"]
+        current_emb = embs[pos]
+        current_dis = cosine(query_embd, current_emb)
+
+        can_merge = True
+        min_pos = pos
+        max_pos = pos
+
+        while can_merge:
+            predecessor_emb = embs[min_pos - 1] if min_pos > 0 else None
+            successor_emb = embs[max_pos + 1] if max_pos + 1 < len(embs) else None
 
             with_predecessor_dis = (
                 cosine(query_embd, (current_emb + predecessor_emb) / 2.0)
@@ -107,29 +640,18 @@ class AnnoyStore(Store):
             current_dis = min_dis
 
             if min_dis == with_pre_and_successor_dis:
-                res = (
-                    connector.get_content_by_chunk_id(predecessor_node.id)
-                    + "\n"
-                    + res
-                    + "\n"
-                    + connector.get_content_by_chunk_id(successor_node.id)
-                )
-                min_index = predecessor_node.index
-                max_index = successor_node.index
+                min_pos -= 1
+                max_pos += 1
                 current_emb = (current_emb + predecessor_emb + successor_emb) / 3.0
             elif min_dis == with_predecessor_dis:
-                res = (
-                    connector.get_content_by_chunk_id(predecessor_node.id) + "\n" + res
-                )
-                min_index = predecessor_node.index
+                min_pos -= 1
                 current_emb = (current_emb + predecessor_emb) / 2.0
             elif min_dis == with_successor_dis:
-                res = res + "\n" + connector.get_content_by_chunk_id(successor_node.id)
-                max_index = successor_node.index
+                max_pos += 1
                 current_emb = (current_emb + successor_emb) / 2.0
             else:
                 can_merge = False
-        return res
+        return min_pos, max_pos + 1
 
     def add_documents(
         self,
@@ -143,51 +665,688 @@ class AnnoyStore(Store):
             doc_name is not None or doc_id is not None
         ), "doc_name or doc_id must not be None when add documents"
 
-        connector = SqliteConnector(self.db_path)
-        with self.lock:
-            connector.add_documents(
-                doc=doc_list,
-                embedding=doc_emb_list,
-                in_doc_index=doc_index,
-                doc_id=doc_id,
-                doc_name=doc_name,
-            )
-        self.index = AnnoyIndex(self.emb_len, self.dis_type)
-        emb_info = connector.get_emb_info()
+        self._load()
+        # The chunks are durable once SQLite committed them, the connector
+        # serializes writers itself so searches are not held up meanwhile.
+        self._connector().add_documents(
+            doc=doc_list,
+            embedding=doc_emb_list,
+            in_doc_index=doc_index,
+            doc_id=doc_id,
+            doc_name=doc_name,
+            dedup=self.dedup,
+        )
         with self.lock:
-            for info in emb_info:
-                self.index.add_item(info["id"], info["embedding"])
-            self.index.build(10)
-            self.index.save(self.index_path)
+            self._sync_matrix()
+            self._bump_version()
+            need_compact = (
+                len(self.matrix) - self._delta_start() >= self.max_delta_size
+                and self._live_count() > self.exact_threshold
+            )
+        if need_compact:
+            self.compact(background=True)
 
-    def search_by_embedding(self, query_emb: List[float], nums: int = 50) -> List[str]:
-        self._load()
+    def compact(self, background: bool = False) -> None:
+        """
+        Merge the delta segment into a new main segment.
+
+        The new index is written next to the old one and moved into place with
+        ``os.replace``, so searches keep using the previous main segment (plus
+        the delta) until the swap. Incremental backends such as IVF only add
+        the delta to the current index and drop the resolved tombstones from
+        it, the others are rebuilt from the whole matrix. Stores with no more
+        than ``exact_threshold`` live chunks drop their index instead.
 
+        A background compaction is queued on the store's ``IndexBuilder``,
+        which folds all compactions requested meanwhile into one build.
+        """
+        if background:
+            self.builder.request()
+            return
+        self._load()
         with self.lock:
-            if self.index is None:
-                return []
+            ids, embs = self.matrix.items()
+            resolved = set(self.tombstones)
+        self._build_main(ids, embs, resolved)
 
-        search_res = self.index.get_nns_by_vector(
-            query_emb, nums, include_distances=True
-        )
-        ids = search_res[0]
-        res = []
-        for id in ids:
-            res.append(self._merge_chunk(id, query_emb))
+    def _build_main(self, ids: np.ndarray, embs: np.ndarray, resolved: set) -> None:
+        # ``ids`` and ``embs`` are views on the embedding matrix, rows of deleted
+        # chunks have a negative id. ``resolved`` holds the tombstones that
+        # were already deleted when the views were taken.
+        with self.build_lock:
+            live = ids > 0
+            live_count = np.count_nonzero(live)
+            # The views follow later deletes, the chunks live when the build
+            # starts are the only ones it can add to the index.
+            built = np.abs(ids[live])
+            if live_count <= self.exact_threshold:
+                if os.path.exists(self.index_path):
+                    os.remove(self.index_path)
+                with self.lock:
+                    self.tombstones -= resolved
+                    self._set_main(None)
+                    self._save_tombstones(self.tombstones)
+                    self._compact_matrix()
+                    self._bump_version()
+                return
+            index = self.index
+            if index is not None and index.incremental and not index.stale(live_count):
+                start = int(np.searchsorted(np.abs(ids), index.max_id, side="right"))
+                index = index.update(ids[start:], embs[start:], resolved)
+            else:
+                index = self._new_index()
+                index.build(ids, embs)
+            with replacing(self.index_path) as tmp_path:
+                index.save(tmp_path)
+            with self.lock:
+                old_max_id = self.main_max_id
+                self.tombstones -= resolved
+                self._set_main(index)
+                # Delta chunks deleted after the build read them are in the new
+                # index but were not tombstoned, they were above the old one.
+                row_ids, _ = self.matrix.items()
+                start, stop = np.searchsorted(
+                    self.matrix.keys, [old_max_id, self.main_max_id], side="right"
+                )
+                deleted = -np.asarray(row_ids[start:stop])
+                deleted = deleted[(deleted > 0) & np.isin(deleted, built)]
+                self.tombstones.update(deleted.tolist())
+                self._save_tombstones(self.tombstones)
+                self._compact_matrix()
+                self._bump_version()
+
+    def search_by_embedding(
+        self,
+        query_emb: List[float],
+        nums: int = 50,
+        return_scores: bool = False,
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        return_hits: bool = False,
+    ) -> List[str] | List[Tuple[str, float]] | List[SearchHit]:
+        return self.search_by_embeddings(
+            [query_emb], nums, return_scores, doc_ids, doc_names, return_hits
+        )[0]
+
+    def search_by_embeddings(
+        self,
+        query_embs: List[List[float]],
+        nums: int = 50,
+        return_scores: bool = False,
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        return_hits: bool = False,
+    ) -> List[List[str]] | List[List[Tuple[str, float]]] | List[List[SearchHit]]:
+        """
+        Search the ``nums`` nearest chunks of every query and merge them with
+        their neighbours.
+
+        Every candidate is ranked by its exact distance: the delta is scanned
+        exactly and the index backends score their candidates against the
+        float vectors. With ``return_scores`` every merged text comes with the
+        cosine similarity between the query and the chunk it was merged
+        around. With ``return_hits`` every result is a ``SearchHit`` with the
+        ids of the merged chunks, its score and its distance.
+
+        ``doc_ids`` and ``doc_names`` restrict the search to the chunks of
+        those documents. Filters that select at most ``exact_threshold``
+        chunks scan exactly these rows of the matrix, larger ones search the
+        index with an over-fetch proportional to the share of the store they
+        exclude.
+        """
+        snapshot = self._load()
+        query_embs = np.asarray(query_embs, dtype=np.float32).reshape(-1, self.emb_len)
+
+        def search(embs: np.ndarray, rows: List[int]) -> List[List[SearchHit]]:
+            chunks = self._doc_filter(doc_ids, doc_names)
+            hit_lists = self._dense_hits(snapshot, embs, nums, chunks)
+            return self._finish(snapshot, hit_lists, embs)
+
+        params = ("dense", nums, doc_ids, doc_names)
+        hits = self._cached(snapshot, query_embs, [params] * len(query_embs), search)
+        return self._format(hits, return_scores, return_hits)
+
+    def hybrid_search_by_embedding(
+        self,
+        query: str,
+        query_emb: List[float],
+        nums: int = 50,
+        return_scores: bool = False,
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        rrf_k: int = 60,
+        return_hits: bool = False,
+    ) -> List[str] | List[Tuple[str, float]] | List[SearchHit]:
+        return self.hybrid_search_by_embeddings(
+            [query],
+            [query_emb],
+            nums,
+            return_scores,
+            doc_ids,
+            doc_names,
+            rrf_k,
+            return_hits,
+        )[0]
+
+    def hybrid_search_by_embeddings(
+        self,
+        queries: List[str],
+        query_embs: List[List[float]],
+        nums: int = 50,
+        return_scores: bool = False,
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        rrf_k: int = 60,
+        return_hits: bool = False,
+    ) -> List[List[str]] | List[List[Tuple[str, float]]] | List[List[SearchHit]]:
+        """
+        Search like ``search_by_embeddings``, but rank the chunks by fusing
+        the vector search with a BM25 full-text search of the query texts.
+
+        Both searches return their ``nums`` best chunks, which are fused with
+        reciprocal-rank fusion: a chunk scores ``1 / (rrf_k + rank)`` in every
+        list it appears in, so exact keyword matches that embed poorly, such
+        as names or codes, still reach the results. The ``nums`` best fused
+        chunks are merged with their neighbours as usual, and the scores
+        returned with ``return_scores`` are still cosine similarities. The
+        fused and BM25 scores are the ``rrf_score`` and ``bm25_score`` of the
+        hits.
+        """
+        assert len(queries) == len(
+            query_embs
+        ), "queries and query_embs should have the same length"
+        snapshot = self._load()
+        query_embs = np.asarray(query_embs, dtype=np.float32).reshape(-1, self.emb_len)
+        connector = self._connector()
+
+        def search(embs: np.ndarray, rows: List[int]) -> List[List[SearchHit]]:
+            chunks = self._doc_filter(doc_ids, doc_names)
+            dense = self._dense_hits(snapshot, embs, nums, chunks)
+            text = [
+                {
+                    (
+                        chunk_id if chunks is None else chunks.get(chunk_id, chunk_id)
+                    ): score
+                    for chunk_id, score in connector.search_fulltext(
+                        queries[row], nums, doc_ids, doc_names, return_scores=True
+                    )
+                }
+                for row in rows
+            ]
+            fused = [
+                self._fuse([hits, list(bm25_scores)], nums, rrf_k)
+                for hits, bm25_scores in zip(dense, text)
+            ]
+            merged = self._finish(
+                snapshot, [list(rrf_scores) for rrf_scores in fused], embs
+            )
+            return [
+                [
+                    hit._replace(
+                        rrf_score=rrf_scores[hit.chunk_id],
+                        bm25_score=bm25_scores.get(hit.chunk_id),
+                    )
+                    for hit in hits
+                ]
+                for rrf_scores, bm25_scores, hits in zip(fused, text, merged)
+            ]
+
+        params = [
+            ("hybrid", query, nums, doc_ids, doc_names, rrf_k) for query in queries
+        ]
+        hits = self._cached(snapshot, query_embs, params, search)
+        return self._format(hits, return_scores, return_hits)
+
+    @staticmethod
+    def _fuse(rankings: List[List[int]], nums: int, rrf_k: int) -> Dict[int, float]:
+        """
+        The ``nums`` best chunk ids by reciprocal-rank fusion of ``rankings``,
+        best first, with their fused scores.
+        """
+        scores = {}
+        for ranking in rankings:
+            for rank, chunk_id in enumerate(ranking, 1):
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (rrf_k + rank)
+        best = sorted(scores, key=lambda chunk_id: -scores[chunk_id])[:nums]
+        return {chunk_id: scores[chunk_id] for chunk_id in best}
+
+    def _doc_filter(
+        self, doc_ids: List[int] = None, doc_names: List[str] = None
+    ) -> Dict[int, int] | None:
+        """
+        The chunks of the documents selected by ``doc_ids`` and ``doc_names``
+        keyed by the chunk holding their embedding, None without a filter.
+        """
+        if not (doc_ids or doc_names):
+            return None
+        return self._connector().get_emb_ids_by_docs(doc_ids, doc_names)
+
+    def _dense_hits(
+        self,
+        snapshot: StoreSnapshot,
+        query_embs: np.ndarray,
+        nums: int,
+        chunks: Dict[int, int] = None,
+    ) -> List[List[int]]:
+        """
+        The ``nums`` nearest chunk ids of every query within the doc filter
+        ``chunks`` of ``_doc_filter``. The candidates are the chunks holding
+        the embeddings, every hit is mapped back to the chunk of the filtered
+        documents it stands for, a linked duplicate or the chunk itself.
+        """
+        if chunks is None:
+            return self._search_hits(snapshot, query_embs, nums)
+        allowed = np.array(list(chunks), dtype=np.int64)
+        if len(allowed) <= self.exact_threshold:
+            hit_lists = self._filtered_scan(snapshot, query_embs, allowed, nums)
+        else:
+            hit_lists = self._search_hits(snapshot, query_embs, nums, allowed)
+        return [[chunks[chunk_id] for chunk_id in hits] for hits in hit_lists]
+
+    def _cached(
+        self,
+        snapshot: StoreSnapshot,
+        query_embs: np.ndarray,
+        params: List[tuple],
+        search,
+    ) -> List[List[SearchHit]]:
+        """
+        The hits of every query, from the result cache if it has them. The
+        other queries are searched together with ``search(embs, rows)``, rows
+        being their indexes in ``query_embs``, and their hits cached.
+        """
+        if self.result_cache is None:
+            return search(query_embs, list(range(len(query_embs))))
+        keys = [
+            self.result_cache.key(
+                self.store_name,
+                snapshot.version,
+                query_emb,
+                query_params,
+                normalize=self.dis_type == "angular",
+            )
+            for query_emb, query_params in zip(query_embs, params)
+        ]
+        res = [self.result_cache.get(key) for key in keys]
+        rows = [i for i, hits in enumerate(res) if hits is None]
+        if rows:
+            embs = query_embs[rows]
+            found = search(embs, rows)
+            for row, hits in zip(rows, found):
+                res[row] = hits
+                self.result_cache.put(keys[row], hits, ResultCache.sizeof([hits]))
         return res
 
+    @staticmethod
+    def _format(
+        hit_lists: List[List[SearchHit]], return_scores: bool, return_hits: bool
+    ) -> List[List[str]] | List[List[Tuple[str, float]]] | List[List[SearchHit]]:
+        if return_hits:
+            return hit_lists
+        if return_scores:
+            return [[(hit.text, hit.score) for hit in hits] for hits in hit_lists]
+        return [[hit.text for hit in hits] for hits in hit_lists]
+
+    def _finish(
+        self,
+        snapshot: StoreSnapshot,
+        hit_lists: List[List[int]],
+        query_embs: np.ndarray,
+    ) -> List[List[SearchHit]]:
+        """Merge the hits of every query, with their scores and distances."""
+        merged, hit_embs = self._merge_chunks(snapshot, hit_lists, query_embs)
+        for i, (query_emb, hits, embs) in enumerate(zip(query_embs, merged, hit_embs)):
+            scores = self._similarities(query_emb, embs)
+            dis = []
+            if len(embs):
+                dis = distances(query_emb[None], embs, self.dis_type)[0].tolist()
+            merged[i] = [
+                hit._replace(score=score, distance=d)
+                for hit, score, d in zip(hits, scores, dis)
+            ]
+        return merged
+
+    def _search_hits(
+        self,
+        snapshot: StoreSnapshot,
+        query_embs: np.ndarray,
+        nums: int,
+        allowed: np.ndarray = None,
+    ) -> List[List[int]]:
+        """
+        The ``nums`` nearest chunk ids of every query from both segments, only
+        chunks in ``allowed`` are kept if it is given.
+        """
+        index = snapshot.index
+        delta_start, delta_stop = snapshot.delta_start, snapshot.size
+        tombstones = snapshot.tombstones
+
+        # Tombstones are spread over the index, so the fetch only grows with
+        # the share of its chunks that are deleted.
+        fetch = -(-nums * delta_start // max(delta_start - len(tombstones), 1))
+        allowed_set = None
+        if allowed is not None:
+            allowed_set = set(allowed.tolist())
+            fetch = -(-fetch * delta_stop // max(len(allowed), 1))
+        delta_dis = None
+        if delta_stop > delta_start:
+            delta_ids, delta_dis = self._scan(
+                snapshot, query_embs, delta_start, delta_stop
+            )
+            if allowed is not None:
+                delta_dis[:, ~np.isin(delta_ids, allowed)] = np.inf
+        hit_lists = []
+        for i, query_emb in enumerate(query_embs):
+            ids, dis = [], []
+            k = fetch
+            while index is not None:
+                main_ids, main_dis = index.search(query_emb, k)
+                ids, dis = [], []
+                for id, d in zip(main_ids, main_dis):
+                    if id not in tombstones and (
+                        allowed_set is None or id in allowed_set
+                    ):
+                        ids.append(id)
+                        dis.append(d)
+                # The over-fetch is only an estimate, tombstones close to the
+                # query or a filter whose chunks are far from it need a wider
+                # search.
+                if len(ids) >= nums or len(main_ids) < k or k > index.max_id:
+                    break
+                k *= 2
+            if delta_dis is not None:
+                top = self._top_k(delta_dis[i], nums)
+                ids += delta_ids[top].tolist()
+                dis += delta_dis[i][top].tolist()
+            order = np.argsort(np.array(dis), kind="stable")[:nums]
+            hit_lists.append([ids[j] for j in order])
+        return hit_lists
+
+    def _filtered_scan(
+        self,
+        snapshot: StoreSnapshot,
+        query_embs: np.ndarray,
+        chunk_ids: np.ndarray,
+        nums: int,
+    ) -> List[List[int]]:
+        """The ``nums`` nearest of ``chunk_ids`` for every query, scanned exactly."""
+        rows = snapshot.matrix.rows(chunk_ids)
+        rows = rows[(rows >= 0) & (rows < snapshot.size)]
+        row_ids, data = snapshot.matrix.items()
+        ids = np.asarray(row_ids[rows])
+        dis = distances(query_embs, data[rows], self.dis_type, snapshot.norms[rows])
+        dis[:, ids <= 0] = np.inf
+        return [ids[self._top_k(d, nums)].tolist() for d in dis]
+
+    @staticmethod
+    def _similarities(query_emb: np.ndarray, embs: np.ndarray) -> List[float]:
+        """Exact cosine similarities between a query and chunk embeddings."""
+        if not len(embs):
+            return []
+        norms = np.linalg.norm(embs, axis=1) * np.linalg.norm(query_emb)
+        return np.clip(embs @ query_emb / np.maximum(norms, 1e-12), -1.0, 1.0).tolist()
+
+    @staticmethod
+    def _top_k(dis: np.ndarray, k: int) -> np.ndarray:
+        """Positions of the ``k`` smallest finite distances, nearest first."""
+        if k < len(dis):
+            top = np.argpartition(dis, k)[:k]
+        else:
+            top = np.arange(len(dis))
+        top = top[np.isfinite(dis[top])]
+        return top[np.argsort(dis[top], kind="stable")]
+
     def delete_by_id(self, chunk_id: int) -> None:
-        connector = SqliteConnector(self.db_path)
-        if not connector.delete_by_id(chunk_id):
+        self.delete_by_ids([chunk_id])
+
+    def delete_by_ids(self, chunk_ids: List[int]) -> None:
+        """
+        Delete chunks without rebuilding the main segment.
+
+        Deleted chunks are dropped from the delta right away and become
+        tombstones for the main segment. A single background compaction runs
+        once the number of tombstones reaches ``max_tombstones``, once the
+        store is small enough to be searched exactly, or once more than
+        ``max_dead_fraction`` of the matrix rows are dead. A duplicate linked to
+        a deleted chunk is stored again under a new id and added to the delta.
+        """
+        self._load()
+        deleted = self._connector().delete_by_ids(chunk_ids)
+        if not deleted:
             return
-        self.index = AnnoyIndex(self.emb_len, self.dis_type)
-        emb_info = connector.get_emb_info()
         with self.lock:
-            for info in emb_info:
-                self.index.add_item(info["id"], info["embedding"])
-            self.index.build(10)
-            self.index.save(self.index_path)
+            self._sync_matrix()
+            # Linked duplicates have no row in the matrix and are not indexed.
+            deleted = [
+                id for id, row in zip(deleted, self.matrix.rows(deleted)) if row >= 0
+            ]
+            self.matrix.remove(deleted)
+            self.tombstones.update(id for id in deleted if id <= self.main_max_id)
+            self._save_tombstones(self.tombstones)
+            self._bump_version()
+            need_compact = (
+                self.index is not None
+                and (
+                    len(self.tombstones) >= self.max_tombstones
+                    or self._live_count() <= self.exact_threshold
+                )
+            ) or self._too_many_dead()
+        if need_compact:
+            self.compact(background=True)
+
+    def export_snapshot(self, path: str) -> None:
+        """
+        Write the store to the tar archive ``path``: a manifest, the columnar
+        document and chunk tables, the float32 embedding matrix with the
+        chunk id of every row, the tombstones and the index file.
+
+        Writes go on while the store is exported, compactions wait for it.
+        The tables are read in one transaction and the published matrix and
+        index are reconciled with them: chunks deleted meanwhile are marked
+        deleted and become tombstones, chunks added meanwhile are appended
+        to the matrix.
+        """
+        with self.build_lock, tempfile.TemporaryDirectory() as tmp:
+            snapshot = self._load()
+            row_ids, data = snapshot.matrix.items()
+            row_ids = np.asarray(row_ids[: snapshot.size])
+            data = data[: snapshot.size]
+            last_id = (
+                int(snapshot.matrix.keys[snapshot.size - 1]) if snapshot.size else 0
+            )
+            connector = self._connector()
+            tables = connector.export_tables(last_id)
+
+            chunk_ids = np.array([row[0] for row in tables["chunks"]], dtype=np.int64)
+            keys = np.abs(row_ids)
+            live = np.isin(keys, chunk_ids)
+            max_id = snapshot.index.max_id if snapshot.index is not None else -1
+            tombstones = set(snapshot.tombstones)
+            tombstones.update(keys[(row_ids > 0) & ~live & (keys <= max_id)].tolist())
+
+            tail_ids = np.array(tables["embedding_ids"], dtype=np.int64)
+            matrix_ids = np.concatenate([np.where(live, keys, -keys), tail_ids])
+            embeddings = np.lib.format.open_memmap(
+                os.path.join(tmp, "embeddings.npy"),
+                "w+",
+                np.float32,
+                (len(matrix_ids), self.emb_len),
+            )
+            embeddings[: len(data)] = data
+            if len(tail_ids):
+                embeddings[len(data) :] = np.stack(tables["embeddings"])
+            embeddings.flush()
+            del embeddings
+            np.save(os.path.join(tmp, "matrix_ids.npy"), matrix_ids)
+            np.save(
+                os.path.join(tmp, "tombstones.npy"),
+                np.array(sorted(tombstones), dtype=np.int64),
+            )
+
+            documents = tables["documents"]
+            names = _pack_strings([row[1] for row in documents])
+            np.savez(
+                os.path.join(tmp, "documents.npz"),
+                id=np.array([row[0] for row in documents], dtype=np.int64),
+                name_offsets=names["offsets"],
+                name_data=names["data"],
+                name_null=names["null"],
+            )
+            chunks = tables["chunks"]
+            contents = _pack_strings([row[3] for row in chunks])
+            np.savez(
+                os.path.join(tmp, "chunks.npz"),
+                id=chunk_ids,
+                doc_id=np.array([row[1] for row in chunks], dtype=np.int64),
+                in_doc_index=np.array([row[2] for row in chunks], dtype=np.int64),
+                content_offsets=contents["offsets"],
+                content_data=contents["data"],
+                content_null=contents["null"],
+                dup_of=np.array([row[4] or 0 for row in chunks], dtype=np.int64),
+            )
+
+            if snapshot.index is not None:
+                shutil.copyfile(self.index_path, os.path.join(tmp, "index"))
+            manifest = {
+                "format": self.SNAPSHOT_FORMAT,
+                "store_name": self.store_name,
+                "version": snapshot.version,
+                "emb_len": self.emb_len,
+                "emb_dtype": np.dtype(connector.emb_dtype).name,
+                "dis_type": self.dis_type,
+                "index_type": self.index_type if snapshot.index is not None else None,
+                "documents": len(documents),
+                "chunks": len(chunks),
+                "last_id": max(
+                    tables["last_id"], int(np.abs(matrix_ids).max(initial=0))
+                ),
+            }
+            with open(os.path.join(tmp, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+
+            with tarfile.open(path, "w") as tar:
+                for name in self.SNAPSHOT_FILES:
+                    if os.path.exists(os.path.join(tmp, name)):
+                        tar.add(os.path.join(tmp, name), arcname=name)
+
+    def import_snapshot(self, path: str) -> None:
+        """
+        Load an archive written by ``export_snapshot`` into this store, which
+        must be empty.
+
+        The tables are bulk loaded in a single transaction and the matrix is
+        written as a whole. The index file is used as it is if it was built
+        with this store's ``index_type`` and ``dis_type``, otherwise a
+        compaction builds a new one in the background.
+        """
+        with tarfile.open(path) as tar, tempfile.TemporaryDirectory() as tmp:
+            # Only the known files are extracted, whatever else the archive
+            # holds.
+            for member in tar.getmembers():
+                if member.name in self.SNAPSHOT_FILES and member.isfile():
+                    with tar.extractfile(member) as src, open(
+                        os.path.join(tmp, member.name), "wb"
+                    ) as dst:
+                        shutil.copyfileobj(src, dst)
+            if not os.path.exists(os.path.join(tmp, "manifest.json")):
+                raise ValueError("the archive has no manifest")
+            with open(os.path.join(tmp, "manifest.json")) as f:
+                manifest = json.load(f)
+            if manifest.get("format") not in range(1, self.SNAPSHOT_FORMAT + 1):
+                raise ValueError(
+                    f"unsupported snapshot format {manifest.get('format')}"
+                )
+            if manifest["emb_len"] != self.emb_len:
+                raise ValueError(
+                    f"the snapshot has emb_len {manifest['emb_len']}, "
+                    f"the store {self.emb_len}"
+                )
+
+            with np.load(os.path.join(tmp, "documents.npz")) as data:
+                documents = list(
+                    zip(
+                        data["id"].tolist(),
+                        _unpack_strings(
+                            data["name_offsets"], data["name_data"], data["name_null"]
+                        ),
+                    )
+                )
+            with np.load(os.path.join(tmp, "chunks.npz")) as data:
+                chunk_ids = data["id"]
+                contents = _unpack_strings(
+                    data["content_offsets"], data["content_data"], data["content_null"]
+                )
+                if "dup_of" in data:
+                    dup_of = [id or None for id in data["dup_of"].tolist()]
+                else:
+                    # Duplicates in older snapshots link to the first chunk
+                    # with their content, they keep their embedding.
+                    first, dup_of = {}, []
+                    for id, content in zip(chunk_ids.tolist(), contents):
+                        link = (
+                            first.setdefault(content, id) if content is not None else id
+                        )
+                        dup_of.append(link if link != id else None)
+                chunks = list(
+                    zip(
+                        chunk_ids.tolist(),
+                        data["doc_id"].tolist(),
+                        data["in_doc_index"].tolist(),
+                        contents,
+                        dup_of,
+                    )
+                )
+            matrix_ids = np.load(os.path.join(tmp, "matrix_ids.npy"))
+            embeddings = np.load(os.path.join(tmp, "embeddings.npy"), mmap_mode="r")
+            keys = np.abs(matrix_ids)
+
+            with self.build_lock:
+                self._load()
+                if len(self.matrix):
+                    raise ValueError(f"store {self.store_name} is not empty")
+                rows = np.searchsorted(keys, chunk_ids)
+                rows[rows >= len(keys)] = 0
+                found = keys[rows] == chunk_ids if len(keys) else rows < 0
+                self._connector().import_tables(
+                    documents,
+                    chunks,
+                    [
+                        embeddings[row] if has_row else None
+                        for row, has_row in zip(rows.tolist(), found.tolist())
+                    ],
+                    manifest["last_id"],
+                )
+                index = None
+                if (
+                    os.path.exists(os.path.join(tmp, "index"))
+                    and manifest["index_type"] == self.index_type
+                    and manifest["dis_type"] == self.dis_type
+                ):
+                    with replacing(self.index_path) as tmp_path:
+                        shutil.copyfile(os.path.join(tmp, "index"), tmp_path)
+                    index = self._new_index()
+                    index.load(self.index_path)
+                with self.lock:
+                    self.matrix.append(keys, embeddings)
+                    self.matrix.remove(keys[matrix_ids < 0].tolist())
+                    self.tombstones = set()
+                    if index is not None:
+                        self.tombstones = set(
+                            np.load(os.path.join(tmp, "tombstones.npy")).tolist()
+                        )
+                    self._set_main(index)
+                    self._save_tombstones(self.tombstones)
+                    self._sync_matrix()
+                    self._bump_version()
+                    need_compact = (
+                        index is None and self._live_count() > self.exact_threshold
+                    )
+        if need_compact:
+            self.compact(background=True)
 
     def get_id_by_doc(self, doc: str) -> int:
-        connector = SqliteConnector(self.db_path)
+        connector = self._connector()
         return connector.get_id_by_doc(doc)
+
+    def get_ids_by_docs(self, docs: List[str]) -> List[int]:
+        return self._connector().get_ids_by_docs(docs)
@@ -0,0 +1,56 @@
+from typing import List, Tuple
+import os
+import numpy as np
+from annoy import AnnoyIndex
+
+from .IndexBackend import IndexBackend
+from .EmbeddingMatrix import EmbeddingMatrix
+
+
+class AnnoyBackend(IndexBackend):
+    suffix = ".ann"
+
+    def __init__(
+        self,
+        emb_len: int,
+        dis_type: str,
+        matrix: EmbeddingMatrix,
+        n_trees: int = 10,
+        rerank: int = 1,
+    ) -> None:
+        super().__init__(emb_len, dis_type, matrix)
+        self.n_trees = n_trees
+        # Annoy scores every candidate it visits exactly, visiting ``rerank``
+        # times its default of ``k * n_trees`` nodes trades latency for recall.
+        self.rerank = rerank
+        self.index = AnnoyIndex(emb_len, dis_type)
+        self.size = 0
+
+    @property
+    def max_id(self) -> int:
+        # Annoy sizes its index by the largest item id.
+        return self.index.get_n_items() - 1
+
+    def build(self, ids: np.ndarray, embs: np.ndarray) -> None:
+        for id, emb in zip(ids.tolist(), embs):
+            if id > 0:
+                self.index.add_item(id, emb)
+        self.index.build(self.n_trees)
+
+    def search(self, query_emb: np.ndarray, k: int) -> Tuple[List[int], List[float]]:
+        return self.index.get_nns_by_vector(
+            query_emb, k, self.rerank * k * self.n_trees, include_distances=True
+        )
+
+    @property
+    def nbytes(self) -> int:
+        # A saved or loaded index is served from its memory-mapped file.
+        return self.size
+
+    def save(self, path: str) -> None:
+        self.index.save(path)
+        self.size = os.path.getsize(path)
+
+    def load(self, path: str) -> None:
+        self.index.load(path)
+        self.size = os.path.getsize(path)
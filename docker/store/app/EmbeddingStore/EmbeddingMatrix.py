@@ -0,0 +1,270 @@
+from contextlib import contextmanager
+from typing import ContextManager, Iterator, List, Tuple
+import fcntl
+import os
+import tempfile
+import threading
+import numpy as np
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Hold an exclusive ``flock`` on ``path``, shared with other processes."""
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def replacing(path: str) -> Iterator[str]:
+    """
+    Yield a uniquely named file next to ``path``, which replaces ``path``
+    once the block succeeds, other processes replacing the same path use
+    their own files.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + "."
+    )
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class EmbeddingMatrix:
+    """
+    A contiguous float32 matrix with every chunk embedding of a store.
+
+    The matrix is kept in ``<path>`` as a ``.npy`` file and memory-mapped, so
+    reads need no SQL and no copies, and several worker processes share the
+    same pages through the page cache. Row ``i`` belongs to the chunk id stored
+    at ``i`` in ``<path>.ids.npy``: ``0`` marks a free row and a negative id a
+    deleted chunk. Chunk ids are AUTOINCREMENT and rows are only appended, so
+    the absolute ids are sorted and a row is found with a binary search.
+
+    ``compact`` writes the rows that are still needed to new files, which
+    keeps the ids sorted. Rows never move within one file, so a compacted
+    matrix is a new object: readers holding the old one keep their mapping.
+
+    Processes creating, growing or compacting the files hold an ``flock`` on
+    ``<path>.lock``, and write the new files under unique temporary names.
+    """
+
+    # Rows copied at once by ``compact``, bounds the memory it needs.
+    COPY_ROWS = 65536
+
+    def __init__(self, path: str, emb_len: int, capacity: int = 1024) -> None:
+        self.path = path
+        self.ids_path = os.path.splitext(path)[0] + ".ids.npy"
+        self.lock_path = os.path.splitext(path)[0] + ".lock"
+        self.emb_len = emb_len
+        self.initial_capacity = capacity
+        self.lock = threading.Lock()
+        self.data = None
+        self.row_ids = None
+        self.keys = np.empty(0, dtype=np.int64)
+        self.size = 0
+        self._open()
+
+    def _open(self) -> None:
+        with self._file_lock():
+            if not (os.path.exists(self.path) and os.path.exists(self.ids_path)):
+                self._create(self.initial_capacity)
+            data, row_ids = self._map()
+            if (
+                data.ndim != 2
+                or data.shape[1] != self.emb_len
+                or data.shape[0] < row_ids.shape[0]
+            ):
+                # The rows are read again from the database by the next sync.
+                self._create(self.initial_capacity)
+                data, row_ids = self._map()
+            self._set_mapping(data, row_ids)
+
+    def _map(self) -> Tuple[np.ndarray, np.ndarray]:
+        return (
+            np.load(self.path, mmap_mode="r+"),
+            np.load(self.ids_path, mmap_mode="r+"),
+        )
+
+    def _set_mapping(self, data: np.ndarray, row_ids: np.ndarray) -> None:
+        self.data = data
+        self.row_ids = row_ids
+        self.inode = os.stat(self.ids_path).st_ino
+        size = min(int(np.count_nonzero(row_ids)), data.shape[0])
+        self.keys = np.abs(np.asarray(row_ids[:size]))
+        self.size = size
+
+    def _file_lock(self) -> ContextManager[None]:
+        """The lock other processes sharing the files take to replace them."""
+        return file_lock(self.lock_path)
+
+    @property
+    def replaced(self) -> bool:
+        """Whether the files were replaced since this matrix opened them."""
+        return os.stat(self.ids_path).st_ino != self.inode
+
+    def extends(self, other: "EmbeddingMatrix") -> bool:
+        """Whether every row of ``other`` is at the same position in this matrix."""
+        return len(self.keys) >= len(other.keys) and np.array_equal(
+            self.keys[: len(other.keys)], other.keys
+        )
+
+    def refresh(self) -> None:
+        """Pick up rows appended by another process sharing the files."""
+        with self.lock:
+            if os.stat(self.ids_path).st_ino != self.inode:
+                self._open()
+                return
+            tail = np.asarray(self.row_ids[self.size :])
+            added = int(np.count_nonzero(tail))
+            if added:
+                self.keys = np.concatenate([self.keys, np.abs(tail[:added])])
+                self.size += added
+
+    def _create(self, capacity: int, size: int = 0) -> None:
+        # The old rows are copied into new files that replace the old ones,
+        # views that readers still hold keep pointing at the old mapping.
+        rows = np.arange(size)
+        self._write(self.path, np.float32, (capacity, self.emb_len), self.data, rows)
+        self._write(self.ids_path, np.int64, (capacity,), self.row_ids, rows)
+
+    def _write(
+        self,
+        path: str,
+        dtype: type,
+        shape: Tuple[int, ...],
+        old: np.ndarray,
+        rows: np.ndarray,
+    ) -> None:
+        """Replace ``path`` with a new array holding the ``rows`` of ``old`` first."""
+        with replacing(path) as tmp_path:
+            new = np.lib.format.open_memmap(tmp_path, "w+", dtype, shape)
+            for start in range(0, len(rows), self.COPY_ROWS):
+                block = rows[start : start + self.COPY_ROWS]
+                new[start : start + len(block)] = old[block]
+            new.flush()
+            del new
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the mapped files and of the in-memory id keys."""
+        return self.data.nbytes + self.row_ids.nbytes + self.keys.nbytes
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def last_id(self) -> int:
+        return int(self.keys[-1]) if self.size else 0
+
+    def append(self, ids: np.ndarray, embs: np.ndarray) -> bool:
+        """
+        Append new chunks, ids already in the matrix are skipped, also those
+        another process appended meanwhile. Returns False without appending if
+        another process compacted the files, this matrix can then only be
+        read and must be replaced by a new one.
+        """
+        with self.lock, self._file_lock():
+            if not self._catch_up():
+                return False
+            keep = ids > self.last_id
+            ids, embs = ids[keep], embs[keep]
+            if not len(ids):
+                return True
+            end = self.size + len(ids)
+            if end > self.data.shape[0]:
+                self._create(max(end, 2 * self.data.shape[0]), self.size)
+                self.data, self.row_ids = self._map()
+                self.inode = os.stat(self.ids_path).st_ino
+            # Write the vectors before their ids, so that a process mapping the
+            # same files never sees an id without its vector.
+            self.data[self.size : end] = embs
+            self.data.flush()
+            self.row_ids[self.size : end] = ids
+            self.row_ids.flush()
+            self.keys = np.concatenate([self.keys, ids])
+            self.size = end
+        return True
+
+    def _catch_up(self) -> bool:
+        """
+        Pick up the rows other processes appended, must be called with the
+        file lock held. Returns False if the files were compacted meanwhile.
+        """
+        if os.stat(self.ids_path).st_ino == self.inode:
+            tail = np.asarray(self.row_ids[self.size :])
+            added = int(np.count_nonzero(tail))
+            if added:
+                self.keys = np.concatenate([self.keys, np.abs(tail[:added])])
+                self.size += added
+            return True
+        # Grown files keep every row in place and can be mapped instead.
+        data, row_ids = self._map()
+        size = min(int(np.count_nonzero(row_ids)), data.shape[0])
+        if size < self.size or not np.array_equal(
+            np.abs(np.asarray(row_ids[: self.size])), self.keys
+        ):
+            return False
+        self._set_mapping(data, row_ids)
+        return True
+
+    def remove(self, ids: List[int]) -> None:
+        with self.lock:
+            rows = self.rows(ids)
+            rows = rows[rows >= 0]
+            self.row_ids[rows] = -self.keys[rows]
+            self.row_ids.flush()
+
+    def compact(self, keep: np.ndarray) -> "EmbeddingMatrix":
+        """
+        Write the rows selected by the mask ``keep`` to new files and return a
+        matrix on them, or this matrix if the files can not shrink or changed
+        since this matrix last read them. This matrix keeps mapping the old
+        files for the readers still using it, and must not be written anymore.
+        """
+        with self.lock, self._file_lock():
+            if os.stat(self.ids_path).st_ino != self.inode or np.count_nonzero(
+                self.row_ids[self.size :]
+            ):
+                return self
+            rows = np.flatnonzero(keep[: self.size])
+            capacity = max(
+                len(rows), min(self.initial_capacity, self.data.shape[0] - 1)
+            )
+            if capacity >= self.data.shape[0] or capacity == 0:
+                return self
+            self._write(
+                self.path, np.float32, (capacity, self.emb_len), self.data, rows
+            )
+            self._write(self.ids_path, np.int64, (capacity,), self.row_ids, rows)
+        return EmbeddingMatrix(self.path, self.emb_len, self.initial_capacity)
+
+    def rows(self, ids: List[int]) -> np.ndarray:
+        """Rows of ``ids`` in the matrix, ``-1`` for ids that are not stored."""
+        ids = np.asarray(ids, dtype=np.int64)
+        keys = self.keys
+        rows = np.searchsorted(keys, ids)
+        rows[rows >= len(keys)] = 0
+        found = (keys[rows] == ids) if len(keys) else np.zeros(len(ids), bool)
+        return np.where(found, rows, -1)
+
+    def get(self, ids: List[int]) -> np.ndarray:
+        """Embeddings of ``ids``, every id must be stored in the matrix."""
+        rows = self.rows(ids)
+        if (rows < 0).any():
+            raise KeyError(f"chunk ids {np.asarray(ids)[rows < 0]} are not stored")
+        return self.data[rows]
+
+    def items(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Chunk ids and embeddings of all rows as views on the mapping, rows of
+        deleted chunks have a negative id and should be skipped by the caller.
+        """
+        return self.row_ids[: self.size], self.data[: self.size]
@@ -0,0 +1,84 @@
+from abc import ABC, abstractmethod
+from typing import List, Tuple
+import numpy as np
+
+from .EmbeddingMatrix import EmbeddingMatrix
+
+
+def distances(
+    query_embs: np.ndarray,
+    embs: np.ndarray,
+    dis_type: str,
+    norms: np.ndarray = None,
+) -> np.ndarray:
+    """
+    Exact distances between every query and every embedding, with the same
+    definition Annoy uses for ``dis_type``. ``norms`` are the row norms of
+    ``embs`` if they are already known.
+    """
+    if norms is None:
+        norms = np.linalg.norm(embs, axis=1)
+    query_norms = np.linalg.norm(query_embs, axis=1)
+    dots = query_embs @ embs.T
+    if dis_type == "angular":
+        cos = dots / np.maximum(np.outer(query_norms, norms), 1e-12)
+        return np.sqrt(np.maximum(2.0 - 2.0 * cos, 0.0))
+    if dis_type == "euclidean":
+        return np.sqrt(
+            np.maximum(query_norms[:, None] ** 2 + norms**2 - 2.0 * dots, 0.0)
+        )
+    raise ValueError(f"dis_type {dis_type} can not be computed exactly")
+
+
+class IndexBackend(ABC):
+    """
+    The vector index behind the main segment of a store.
+
+    ``build`` and ``search`` work with chunk ids, rows whose id is not positive
+    are deleted chunks and are skipped by ``build``. An index is immutable once
+    it is searched: backends that can grow without a rebuild set
+    ``incremental`` and return a new index from ``update``.
+    """
+
+    suffix = ".idx"
+    incremental = False
+
+    def __init__(self, emb_len: int, dis_type: str, matrix: EmbeddingMatrix) -> None:
+        self.emb_len = emb_len
+        self.dis_type = dis_type
+        self.matrix = matrix
+
+    @property
+    @abstractmethod
+    def max_id(self) -> int:
+        raise NotImplementedError("max_id must be implemented in a sub class")
+
+    @abstractmethod
+    def build(self, ids: np.ndarray, embs: np.ndarray) -> None:
+        raise NotImplementedError("build must be implemented in a sub class")
+
+    def update(
+        self, ids: np.ndarray, embs: np.ndarray, removed: List[int]
+    ) -> "IndexBackend":
+        raise NotImplementedError(f"{type(self).__name__} can not be updated")
+
+    @property
+    def nbytes(self) -> int:
+        """Memory the index holds or maps, used to budget resident stores."""
+        return 0
+
+    def stale(self, size: int) -> bool:
+        """Whether an incremental index should be rebuilt for ``size`` chunks."""
+        return False
+
+    @abstractmethod
+    def search(self, query_emb: np.ndarray, k: int) -> Tuple[List[int], List[float]]:
+        raise NotImplementedError("search must be implemented in a sub class")
+
+    @abstractmethod
+    def save(self, path: str) -> None:
+        raise NotImplementedError("save must be implemented in a sub class")
+
+    @abstractmethod
+    def load(self, path: str) -> None:
+        raise NotImplementedError("load must be implemented in a sub class")
@@ -0,0 +1,60 @@
+from typing import Callable
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class IndexBuilder:
+    """
+    Runs the index builds of one store on a background thread.
+
+    ``request`` only marks a build as pending and returns at once. The
+    builder waits ``delay`` seconds so that a burst of writes is folded into
+    one build, and requests made while a build runs are coalesced into a
+    single follow-up build with everything written in the meantime. The
+    thread exits once nothing is pending.
+    """
+
+    def __init__(self, build: Callable[[], None], delay: float = 0.5) -> None:
+        self.build = build
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.pending = False
+        self.thread = None
+        self.builds = 0
+
+    @property
+    def busy(self) -> bool:
+        with self.lock:
+            return self.thread is not None
+
+    def request(self) -> None:
+        with self.lock:
+            self.pending = True
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.delay)
+            with self.lock:
+                if not self.pending:
+                    self.thread = None
+                    return
+                # Requests from here on are served by the next round.
+                self.pending = False
+            try:
+                self.build()
+                self.builds += 1
+            except Exception:
+                logger.exception("background index build failed")
+
+    def wait(self, timeout: float = None) -> None:
+        """Block until no build is pending or running."""
+        with self.lock:
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
@@ -0,0 +1,207 @@
+from typing import Dict, List, Tuple
+import copy
+import numpy as np
+
+from .IndexBackend import IndexBackend, distances
+from .EmbeddingMatrix import EmbeddingMatrix
+
+
+class IvfBackend(IndexBackend):
+    """
+    An inverted file index: a k-means coarse quantizer splits the vectors into
+    ``nlist`` lists, and a search scans only the ``nprobe`` lists whose
+    centroids are nearest to the query.
+
+    The index only holds the centroids and the chunk ids of every list, the
+    vectors are read from the embedding matrix when a list is scanned. New
+    chunks are assigned to their nearest centroid, so adding chunks costs the
+    same however large the store is, and the centroids are only trained again
+    once the store has grown well past the size they were trained on.
+    """
+
+    suffix = ".ivf"
+    incremental = True
+
+    def __init__(
+        self,
+        emb_len: int,
+        dis_type: str,
+        matrix: EmbeddingMatrix,
+        nlist: int = None,
+        nprobe: int = 8,
+        n_iter: int = 20,
+        train_size: int = 256,
+        retrain_factor: float = 4.0,
+    ) -> None:
+        super().__init__(emb_len, dis_type, matrix)
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        # Training points per list, a sample of the store is enough to place
+        # the centroids.
+        self.train_size = train_size
+        self.retrain_factor = retrain_factor
+        self.centroids = np.empty((0, emb_len), dtype=np.float32)
+        self.lists: List[np.ndarray] = []
+        self.trained_on = 0
+        self._max_id = -1
+
+    @property
+    def max_id(self) -> int:
+        return self._max_id
+
+    def _prepare(self, embs: np.ndarray) -> np.ndarray:
+        # Angular distance is monotonic in the cosine, so both vectors and
+        # centroids live on the unit sphere.
+        embs = np.asarray(embs, dtype=np.float32)
+        if self.dis_type == "angular":
+            embs = embs / np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+        return embs
+
+    def _assign(self, embs: np.ndarray, nprobe: int = 1) -> np.ndarray:
+        """The ``nprobe`` nearest lists of every prepared vector, nearest first."""
+        if self.dis_type == "angular":
+            scores = -(embs @ self.centroids.T)
+        else:
+            scores = (self.centroids**2).sum(axis=1) - 2.0 * (embs @ self.centroids.T)
+        nprobe = min(nprobe, len(self.centroids))
+        if nprobe < len(self.centroids):
+            top = np.argpartition(scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            top = np.broadcast_to(np.arange(nprobe), scores.shape).copy()
+        order = np.argsort(np.take_along_axis(scores, top, axis=1), axis=1)
+        return np.take_along_axis(top, order, axis=1)
+
+    def _train(self, embs: np.ndarray, nlist: int) -> None:
+        rng = np.random.default_rng(0)
+        if len(embs) > nlist * self.train_size:
+            sample = rng.choice(len(embs), nlist * self.train_size, replace=False)
+            embs = embs[np.sort(sample)]
+        embs = self._prepare(embs)
+        self.centroids = embs[rng.choice(len(embs), nlist, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assign = self._assign(embs)[:, 0]
+            counts = np.bincount(assign, minlength=nlist)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assign, embs)
+            empty = counts == 0
+            # Empty lists are reseeded with random points.
+            sums[empty] = embs[rng.choice(len(embs), int(empty.sum()))]
+            counts[empty] = 1
+            self.centroids = sums / counts[:, None]
+            if self.dis_type == "angular":
+                self.centroids = self._prepare(self.centroids)
+
+    def _fit(self, embs: np.ndarray) -> None:
+        """Train whatever the lists store next to the ids, after the centroids."""
+
+    def _add(self, ids: np.ndarray, embs: np.ndarray) -> None:
+        """Append new chunks to their nearest lists."""
+        embs = self._prepare(embs)
+        assign = self._assign(embs)[:, 0]
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(self.centroids) + 1))
+        for i in range(len(self.centroids)):
+            rows = order[bounds[i] : bounds[i + 1]]
+            if len(rows):
+                self._extend(i, ids[rows], embs[rows])
+
+    def _reset(self, nlist: int) -> None:
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(nlist)]
+
+    def _extend(self, i: int, ids: np.ndarray, embs: np.ndarray) -> None:
+        self.lists[i] = np.concatenate([self.lists[i], ids])
+
+    def _keep(self, i: int, keep: np.ndarray) -> None:
+        self.lists[i] = self.lists[i][keep]
+
+    def _copy(self) -> "IvfBackend":
+        # Lists are replaced and never changed in place, so a shallow copy of
+        # the list of lists is enough to leave this index untouched.
+        index = copy.copy(self)
+        index.lists = list(self.lists)
+        return index
+
+    def build(self, ids: np.ndarray, embs: np.ndarray) -> None:
+        live = ids > 0
+        ids, embs = np.asarray(ids)[live], embs[live]
+        if not len(ids):
+            raise ValueError("an IVF index needs at least one vector to train on")
+        nlist = min(self.nlist or max(1, int(np.sqrt(len(ids)))), len(ids))
+        self._train(embs, nlist)
+        self._fit(embs)
+        self._reset(nlist)
+        self._add(ids, embs)
+        self.trained_on = len(ids)
+        self._max_id = int(ids.max())
+
+    def update(
+        self, ids: np.ndarray, embs: np.ndarray, removed: List[int]
+    ) -> "IvfBackend":
+        """
+        Return a new index with ``ids`` added and ``removed`` dropped. Lists
+        that are not touched are shared with this index, which is left as it
+        is for the searches still running on it.
+        """
+        live = np.asarray(ids) > 0
+        ids, embs = np.asarray(ids)[live], embs[live]
+        index = self._copy()
+        if removed:
+            removed = np.fromiter(removed, np.int64)
+            for i, list_ids in enumerate(index.lists):
+                drop = np.isin(list_ids, removed)
+                if drop.any():
+                    index._keep(i, ~drop)
+        if len(ids):
+            index._add(ids, embs)
+            index._max_id = max(self._max_id, int(ids.max()))
+        return index
+
+    @property
+    def nbytes(self) -> int:
+        return self.centroids.nbytes + sum(ids.nbytes for ids in self.lists)
+
+    def stale(self, size: int) -> bool:
+        return size > self.retrain_factor * self.trained_on
+
+    def _candidates(
+        self, query_emb: np.ndarray, probes: np.ndarray, k: int
+    ) -> np.ndarray:
+        """Chunk ids of the probed lists that are scored exactly."""
+        return np.concatenate([self.lists[i] for i in probes])
+
+    def search(self, query_emb: np.ndarray, k: int) -> Tuple[List[int], List[float]]:
+        query_emb = np.asarray(query_emb, dtype=np.float32).reshape(1, -1)
+        prepared = self._prepare(query_emb)
+        probes = self._assign(prepared, self.nprobe)[0]
+        ids = self._candidates(prepared[0], probes, k)
+        if not len(ids):
+            return [], []
+        dis = distances(query_emb, self.matrix.get(ids), self.dis_type)[0]
+        if k < len(dis):
+            top = np.argpartition(dis, k)[:k]
+        else:
+            top = np.arange(len(dis))
+        top = top[np.argsort(dis[top], kind="stable")]
+        return ids[top].tolist(), dis[top].tolist()
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "centroids": self.centroids,
+            "ids": np.concatenate(self.lists).astype(np.int64),
+            "sizes": np.array([len(ids) for ids in self.lists], dtype=np.int64),
+            "meta": np.array([self.trained_on, self._max_id], dtype=np.int64),
+        }
+
+    def _restore(self, data: Dict[str, np.ndarray]) -> None:
+        self.centroids = data["centroids"]
+        self.lists = np.split(data["ids"], np.cumsum(data["sizes"])[:-1])
+        self.trained_on, self._max_id = data["meta"].tolist()
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            np.savez(f, **self._arrays())
+
+    def load(self, path: str) -> None:
+        with np.load(path) as data:
+            self._restore(data)
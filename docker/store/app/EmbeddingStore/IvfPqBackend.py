@@ -0,0 +1,118 @@
+from typing import Dict
+import numpy as np
+
+from .QuantizedIvfBackend import QuantizedIvfBackend
+from .EmbeddingMatrix import EmbeddingMatrix
+
+
+class IvfPqBackend(QuantizedIvfBackend):
+    """
+    An IVF index whose lists hold product-quantized codes instead of scanning
+    full vectors.
+
+    The residual of every vector to its list centroid is split into ``m``
+    sub-vectors, and each sub-vector is stored as the one byte index of its
+    nearest centroid in a per-subspace codebook of 256 centroids. With the
+    default ``m = emb_len / 4`` a 1024 dimension float32 vector (4096 bytes)
+    becomes a 256 byte code.
+
+    A search builds, for each probed list, an asymmetric distance table
+    between the full-precision query residual and every codebook centroid,
+    so the approximate distance of a code is a sum of ``m`` table lookups.
+    """
+
+    suffix = ".ivfpq"
+
+    def __init__(
+        self,
+        emb_len: int,
+        dis_type: str,
+        matrix: EmbeddingMatrix,
+        nlist: int = None,
+        nprobe: int = 8,
+        m: int = None,
+        rerank: int = 4,
+        n_iter: int = 20,
+        train_size: int = 256,
+        retrain_factor: float = 4.0,
+        pq_iter: int = 10,
+        pq_train_size: int = 16384,
+    ) -> None:
+        super().__init__(
+            emb_len,
+            dis_type,
+            matrix,
+            nlist,
+            nprobe,
+            rerank,
+            n_iter,
+            train_size,
+            retrain_factor,
+        )
+        self.m = m or max(1, emb_len // 4)
+        assert emb_len % self.m == 0, "emb_len must be a multiple of m"
+        self.dsub = emb_len // self.m
+        self.pq_iter = pq_iter
+        self.pq_train_size = pq_train_size
+        self.codebooks = np.empty((self.m, 0, self.dsub), dtype=np.float32)
+
+    def _residuals(self, embs: np.ndarray, assign: np.ndarray) -> np.ndarray:
+        return (embs - self.centroids[assign]).reshape(len(embs), self.m, self.dsub)
+
+    @staticmethod
+    def _nearest(subs: np.ndarray, codebook: np.ndarray) -> np.ndarray:
+        # ||x - c||^2 without the ||x||^2 term, which is the same for every c.
+        scores = (codebook**2).sum(axis=1) - 2.0 * (subs @ codebook.T)
+        return np.argmin(scores, axis=1)
+
+    def _fit(self, embs: np.ndarray) -> None:
+        rng = np.random.default_rng(0)
+        if len(embs) > self.pq_train_size:
+            sample = rng.choice(len(embs), self.pq_train_size, replace=False)
+            embs = embs[np.sort(sample)]
+        embs = self._prepare(embs)
+        residuals = self._residuals(embs, self._assign(embs)[:, 0])
+        ksub = min(256, len(embs))
+        self.codebooks = np.empty((self.m, ksub, self.dsub), dtype=np.float32)
+        for j in range(self.m):
+            subs = residuals[:, j]
+            codebook = subs[rng.choice(len(subs), ksub, replace=False)].copy()
+            for _ in range(self.pq_iter):
+                assign = self._nearest(subs, codebook)
+                counts = np.bincount(assign, minlength=ksub)
+                sums = np.zeros_like(codebook)
+                np.add.at(sums, assign, subs)
+                empty = counts == 0
+                sums[empty] = subs[rng.choice(len(subs), int(empty.sum()))]
+                counts[empty] = 1
+                codebook = sums / counts[:, None]
+            self.codebooks[j] = codebook
+
+    def _encode(self, i: int, embs: np.ndarray) -> np.ndarray:
+        residuals = self._residuals(embs, np.full(len(embs), i))
+        codes = np.empty((len(embs), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = self._nearest(residuals[:, j], self.codebooks[j])
+        return codes
+
+    def _approximate(self, query_emb: np.ndarray, i: int) -> np.ndarray:
+        target = (query_emb - self.centroids[i]).reshape(self.m, 1, self.dsub)
+        table = ((target - self.codebooks) ** 2).sum(axis=2)
+        return table[np.arange(self.m), self.codes[i]].sum(axis=1)
+
+    @property
+    def code_size(self) -> int:
+        return self.m + np.dtype(np.int64).itemsize
+
+    @property
+    def nbytes(self) -> int:
+        return super().nbytes + self.codebooks.nbytes
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super()._arrays()
+        arrays["codebooks"] = self.codebooks
+        return arrays
+
+    def _restore(self, data: Dict[str, np.ndarray]) -> None:
+        super()._restore(data)
+        self.codebooks = data["codebooks"]
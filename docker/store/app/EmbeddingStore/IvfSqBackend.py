@@ -0,0 +1,75 @@
+from typing import Dict
+import numpy as np
+
+from .QuantizedIvfBackend import QuantizedIvfBackend
+from .EmbeddingMatrix import EmbeddingMatrix
+
+
+class IvfSqBackend(QuantizedIvfBackend):
+    """
+    An IVF index whose lists hold int8 scalar-quantized vectors.
+
+    Every dimension is mapped linearly from the range seen while training
+    onto the 256 int8 values, so a code takes a quarter of the float32
+    vector. The first pass decodes the probed lists and ranks them against
+    the query, and the best candidates are scored exactly from the embedding
+    matrix.
+    """
+
+    suffix = ".ivfsq"
+
+    def __init__(
+        self,
+        emb_len: int,
+        dis_type: str,
+        matrix: EmbeddingMatrix,
+        nlist: int = None,
+        nprobe: int = 8,
+        rerank: int = 4,
+        n_iter: int = 20,
+        train_size: int = 256,
+        retrain_factor: float = 4.0,
+    ) -> None:
+        super().__init__(
+            emb_len,
+            dis_type,
+            matrix,
+            nlist,
+            nprobe,
+            rerank,
+            n_iter,
+            train_size,
+            retrain_factor,
+        )
+        self.low = np.zeros(emb_len, dtype=np.float32)
+        self.step = np.ones(emb_len, dtype=np.float32)
+
+    def _fit(self, embs: np.ndarray) -> None:
+        embs = self._prepare(embs)
+        self.low = embs.min(axis=0)
+        self.step = np.maximum(embs.max(axis=0) - self.low, 1e-12) / 255.0
+
+    def _encode(self, i: int, embs: np.ndarray) -> np.ndarray:
+        # Vectors added after training may fall outside the trained range and
+        # are clipped to it.
+        codes = np.clip(np.rint((embs - self.low) / self.step), 0, 255) - 128
+        return codes.astype(np.int8)
+
+    def _approximate(self, query_emb: np.ndarray, i: int) -> np.ndarray:
+        decoded = (self.codes[i].astype(np.float32) + 128.0) * self.step + self.low
+        return ((decoded - query_emb) ** 2).sum(axis=1)
+
+    @property
+    def code_size(self) -> int:
+        return self.emb_len + np.dtype(np.int64).itemsize
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super()._arrays()
+        arrays["low"] = self.low
+        arrays["step"] = self.step
+        return arrays
+
+    def _restore(self, data: Dict[str, np.ndarray]) -> None:
+        super()._restore(data)
+        self.low = data["low"]
+        self.step = data["step"]
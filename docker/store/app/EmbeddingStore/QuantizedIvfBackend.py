@@ -0,0 +1,96 @@
+from abc import abstractmethod
+from typing import Dict, List
+import numpy as np
+
+from .IvfBackend import IvfBackend
+from .EmbeddingMatrix import EmbeddingMatrix
+
+
+class QuantizedIvfBackend(IvfBackend):
+    """
+    An IVF index whose lists hold compressed codes next to the chunk ids.
+
+    The probed lists are ranked by the approximate distances of their codes,
+    and only the ``rerank * k`` best candidates are read from the embedding
+    matrix and scored exactly, so the float vectors stay out of the scan.
+    Sub classes train the quantizer in ``_fit`` and implement ``_encode`` and
+    ``_approximate``.
+    """
+
+    def __init__(
+        self,
+        emb_len: int,
+        dis_type: str,
+        matrix: EmbeddingMatrix,
+        nlist: int = None,
+        nprobe: int = 8,
+        rerank: int = 4,
+        n_iter: int = 20,
+        train_size: int = 256,
+        retrain_factor: float = 4.0,
+    ) -> None:
+        super().__init__(
+            emb_len, dis_type, matrix, nlist, nprobe, n_iter, train_size, retrain_factor
+        )
+        self.rerank = rerank
+        self.codes: List[np.ndarray] = []
+
+    @property
+    @abstractmethod
+    def code_size(self) -> int:
+        """Bytes held in memory per indexed vector: its code and its chunk id."""
+        raise NotImplementedError("code_size must be implemented in a sub class")
+
+    @abstractmethod
+    def _encode(self, i: int, embs: np.ndarray) -> np.ndarray:
+        """Codes of prepared vectors assigned to list ``i``."""
+        raise NotImplementedError("_encode must be implemented in a sub class")
+
+    @abstractmethod
+    def _approximate(self, query_emb: np.ndarray, i: int) -> np.ndarray:
+        """Approximate squared distances between a prepared query and list ``i``."""
+        raise NotImplementedError("_approximate must be implemented in a sub class")
+
+    @property
+    def nbytes(self) -> int:
+        return super().nbytes + sum(codes.nbytes for codes in self.codes)
+
+    def _reset(self, nlist: int) -> None:
+        super()._reset(nlist)
+        empty = np.empty((0, self.emb_len), dtype=np.float32)
+        self.codes = [self._encode(i, empty) for i in range(nlist)]
+
+    def _extend(self, i: int, ids: np.ndarray, embs: np.ndarray) -> None:
+        super()._extend(i, ids, embs)
+        self.codes[i] = np.concatenate([self.codes[i], self._encode(i, embs)])
+
+    def _keep(self, i: int, keep: np.ndarray) -> None:
+        super()._keep(i, keep)
+        self.codes[i] = self.codes[i][keep]
+
+    def _copy(self) -> "QuantizedIvfBackend":
+        index = super()._copy()
+        index.codes = list(self.codes)
+        return index
+
+    def _candidates(
+        self, query_emb: np.ndarray, probes: np.ndarray, k: int
+    ) -> np.ndarray:
+        probes = [i for i in probes if len(self.lists[i])]
+        if not probes:
+            return np.empty(0, dtype=np.int64)
+        ids = np.concatenate([self.lists[i] for i in probes])
+        dis = np.concatenate([self._approximate(query_emb, i) for i in probes])
+        n = self.rerank * k
+        if n < len(dis):
+            ids = ids[np.argpartition(dis, n)[:n]]
+        return ids
+
+    def _arrays(self) -> Dict[str, np.ndarray]:
+        arrays = super()._arrays()
+        arrays["codes"] = np.concatenate(self.codes)
+        return arrays
+
+    def _restore(self, data: Dict[str, np.ndarray]) -> None:
+        super()._restore(data)
+        self.codes = np.split(data["codes"], np.cumsum(data["sizes"])[:-1])
@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+import hashlib
+import os
+import sys
+import threading
+import numpy as np
+
+
+class ResultCache:
+    """
+    An LRU cache of search results, shared by the stores of a service.
+
+    Results are keyed by the store, its version, the query embedding rounded
+    to a grid of ``quantum`` and the search parameters. Every write bumps
+    the version of its store, so a write makes the older results of that
+    store unreachable and they simply age out. Near-identical queries, such
+    as the same text embedded twice, fall into the same grid cell and share
+    their results.
+
+    Entries are evicted least recently used first once they hold more than
+    ``memory_budget`` bytes, which defaults to the ``STORE_RESULT_CACHE_MB``
+    environment variable, 64 MB if it is not set. A budget of 0 disables the
+    cache.
+    """
+
+    def __init__(self, memory_budget: int = None, quantum: float = 1e-3) -> None:
+        if memory_budget is None:
+            memory_budget = int(os.environ.get("STORE_RESULT_CACHE_MB", 64)) << 20
+        self.memory_budget = memory_budget
+        self.quantum = quantum
+        self.lock = threading.Lock()
+        # key -> (value, bytes), least recently used first
+        self.entries: OrderedDict[bytes, Tuple[object, int]] = OrderedDict()
+        self.memory_usage = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(
+        self,
+        store_name: str,
+        version: int,
+        query_emb: np.ndarray,
+        params: tuple,
+        normalize: bool = False,
+    ) -> bytes:
+        """
+        The key of a search. ``normalize`` rounds the direction of the query
+        only, for distances that do not depend on its length.
+        """
+        query_emb = np.asarray(query_emb, dtype=np.float32)
+        if normalize:
+            query_emb = query_emb / max(float(np.linalg.norm(query_emb)), 1e-12)
+        grid = np.round(query_emb / self.quantum).astype(np.int64)
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(repr((store_name, version, params)).encode("utf-8"))
+        digest.update(grid.tobytes())
+        return digest.digest()
+
+    def get(self, key: bytes):
+        """The cached value of ``key``, None if it is not cached."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: bytes, value, nbytes: int) -> None:
+        if nbytes > self.memory_budget:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.memory_usage -= old[1]
+            self.entries[key] = (value, nbytes)
+            self.memory_usage += nbytes
+            while self.memory_usage > self.memory_budget:
+                _, (_, size) = self.entries.popitem(last=False)
+                self.memory_usage -= size
+                self.evictions += 1
+
+    @staticmethod
+    def sizeof(hit_lists: List[list]) -> int:
+        """Estimated bytes held by cached search hits."""
+        size = 0
+        for hits in hit_lists:
+            for hit in hits:
+                size += sys.getsizeof(hit) + sys.getsizeof(hit.chunk_ids)
+                size += sys.getsizeof(hit.text) + 32 * len(hit.chunk_ids)
+        return size
+
+    def stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "memory_budget": self.memory_budget,
+                "memory_usage": self.memory_usage,
+            }
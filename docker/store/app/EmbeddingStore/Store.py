@@ -7,13 +7,15 @@ class Store(ABC):
     _instance = {}
     _lock = threading.Lock()
 
-    def __new__(cls, index_path: str = None, store_name: str = "store"):
+    def __new__(
+        cls, index_path: str = None, *args, store_name: str = "store", **kwargs
+    ):
         with cls._lock:
             if index_path:
                 store_name = index_path.split("/")[-1].split(".")[0]
             if store_name not in cls._instance:
                 cls._instance[store_name] = super(Store, cls).__new__(cls)
-                cls._instance[store_name].__initialized = False
+                cls._instance[store_name]._initialized = False
 
         return cls._instance[store_name]
 
@@ -22,12 +24,12 @@ class Store(ABC):
         index_path: str = None,
         store_name: str = "store",
     ):
-        if hasattr(self, "__initialized") and self.__initialized:
+        if self._initialized:
             return
         self.index_path = index_path
         self.lock = threading.Lock()
         self.store_name = store_name
-        self.__initialized = True
+        self._initialized = True
 
     @abstractmethod
     def add_documents(
@@ -50,6 +52,13 @@ class Store(ABC):
     def get_id_by_doc(self, doc: str) -> int:
         raise NotImplementedError("get_id_by_doc must be implemented in a sub class")
 
+    def get_ids_by_docs(self, docs: List[str]) -> List[int]:
+        return [self.get_id_by_doc(doc) for doc in docs]
+
     @abstractmethod
     def delete_by_id(self, doc_id: int) -> None:
         raise NotImplementedError("delete_by_id must be implemented in a sub class")
+
+    def delete_by_ids(self, doc_ids: List[int]) -> None:
+        for doc_id in doc_ids:
+            self.delete_by_id(doc_id)
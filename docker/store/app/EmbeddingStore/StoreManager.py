@@ -0,0 +1,116 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator
+import os
+import threading
+
+from .AnnStore import AnnoyStore
+from .ResultCache import ResultCache
+
+
+class StoreManager:
+    """
+    Keeps the loaded stores within a memory budget.
+
+    Stores are handed out by ``use``, which records every access. Once the
+    loaded stores hold more than ``memory_budget`` bytes, the least recently
+    used ones are unloaded until the rest fits again; an unloaded store
+    stays registered and loads itself lazily on its next search. Stores that
+    are in use or compacting are never unloaded, and the most recently used
+    store is kept even if it alone exceeds the budget.
+
+    The budget defaults to the ``STORE_MEMORY_BUDGET_MB`` environment
+    variable, 4096 MB if it is not set. The stores share one ``ResultCache``
+    of search results.
+
+    Stores are created with the options set in the environment variables of
+    ``STORE_OPTIONS``, the variables that are not set keep the defaults of
+    ``AnnoyStore``.
+    """
+
+    # environment variable -> (AnnoyStore argument, conversion)
+    STORE_OPTIONS = {
+        "STORE_INDEX_TYPE": ("index_type", str),
+        "STORE_NLIST": ("nlist", int),
+        "STORE_NPROBE": ("nprobe", int),
+        "STORE_PQ_M": ("pq_m", int),
+        "STORE_RERANK": ("rerank", int),
+        "STORE_MERGE_MODE": ("merge_mode", str),
+        "STORE_MAX_WINDOW": ("max_window", int),
+        "STORE_EMB_DTYPE": ("emb_dtype", str),
+        "STORE_EXACT_THRESHOLD": ("exact_threshold", int),
+        "STORE_DEDUP": ("dedup", str),
+    }
+
+    def __init__(self, memory_budget: int = None) -> None:
+        if memory_budget is None:
+            memory_budget = int(os.environ.get("STORE_MEMORY_BUDGET_MB", 4096)) << 20
+        self.memory_budget = memory_budget
+        self.lock = threading.Lock()
+        # store_name -> store, least recently used first
+        self.stores: OrderedDict[str, AnnoyStore] = OrderedDict()
+        self.users: Dict[str, int] = {}
+        self.usage: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.result_cache = ResultCache()
+        self.store_options = {
+            arg: convert(os.environ[var])
+            for var, (arg, convert) in self.STORE_OPTIONS.items()
+            if os.environ.get(var)
+        }
+
+    @contextmanager
+    def use(self, store_name: str) -> Iterator[AnnoyStore]:
+        with self.lock:
+            store = self.stores.get(store_name)
+            if store is not None and store.loaded:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if store is None:
+                store = AnnoyStore(
+                    store_name=store_name,
+                    result_cache=self.result_cache,
+                    **self.store_options,
+                )
+                self.stores[store_name] = store
+            self.stores.move_to_end(store_name)
+            self.users[store_name] = self.users.get(store_name, 0) + 1
+        try:
+            yield store
+        finally:
+            usage = store.memory_usage()
+            with self.lock:
+                self.users[store_name] -= 1
+                self.usage[store_name] = usage
+                self._evict()
+
+    def _evict(self) -> None:
+        """Unload least recently used stores until the budget holds, under ``lock``."""
+        total = sum(self.usage.values())
+        for store_name in list(self.stores)[:-1]:
+            if total <= self.memory_budget:
+                return
+            if self.users.get(store_name) or not self.usage.get(store_name):
+                continue
+            if self.stores[store_name].unload():
+                total -= self.usage.pop(store_name)
+                self.evictions += 1
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "memory_budget": self.memory_budget,
+                "memory_usage": sum(self.usage.values()),
+                "loaded_stores": [
+                    store_name
+                    for store_name, store in self.stores.items()
+                    if store.loaded
+                ],
+                "result_cache": self.result_cache.stats(),
+            }
@@ -1,32 +1,49 @@
 from abc import ABC, abstractmethod
 from typing import List
+import os
 import threading
 
 
 class SqlConnector(ABC):
-    _instance = None
+    # One connector per database file, so that stores never share another
+    # store's connections and every database has its own write lock.
+    _instance = {}
     _lock = threading.Lock()
 
-    def __new__(cls, *args, **kwargs):
-        if not cls._instance:
-            with cls._lock:
-                if not cls._instance:
-                    cls._instance = super(SqlConnector, cls).__new__(cls)
-                    cls._instance.__initialized = False
-        return cls._instance
+    def __new__(cls, db_path, *args, **kwargs):
+        db_path = os.path.abspath(db_path)
+        with cls._lock:
+            if db_path not in cls._instance:
+                cls._instance[db_path] = super(SqlConnector, cls).__new__(cls)
+                cls._instance[db_path]._initialized = False
+        return cls._instance[db_path]
 
     def __init__(
         self,
         db_path,
+        emb_dtype: str = "float32",
     ):
-        if hasattr(self, "__initialized") and self.__initialized:
-            return
-        self.db_path = db_path
-        self.index = None
-        self.lock = threading.Lock()
-        self.conn = None
-        self._setup_database()
-        self.__initialized = True
+        with self._lock:
+            if self._initialized:
+                return
+            self.db_path = os.path.abspath(db_path)
+            self.emb_dtype = emb_dtype
+            self.index = None
+            # Serializes the writers of this database.
+            self.lock = threading.Lock()
+            self._setup_database()
+            self._initialized = True
+
+    @classmethod
+    def close(cls, db_path) -> None:
+        """Close the connections of a database, the next use opens new ones."""
+        with cls._lock:
+            connector = cls._instance.pop(os.path.abspath(db_path), None)
+        if connector is not None:
+            connector._close()
+
+    def _close(self) -> None:
+        pass
 
     @abstractmethod
     def _setup_database(self):
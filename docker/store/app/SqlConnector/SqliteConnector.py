@@ -1,18 +1,105 @@
-from typing import List, Dict
+from typing import List, Dict, Tuple
 import threading
 import sqlite3
 import pickle
+import hashlib
+import re
+import numpy as np
 
-from DocTree import DocTree, DocNode
 from .SqlConnector import SqlConnector
 
+# Runs of CJK ideographs and kana, and runs of other word characters.
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+_TOKEN = re.compile(f"([{_CJK}]+)|([^\\W{_CJK}]+)")
+
+
+def content_hash(text: str) -> bytes | None:
+    """The key chunks with the same content are deduplicated on."""
+    if text is None:
+        return None
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+def fulltext_tokens(text: str, query: bool = False) -> List[str]:
+    """
+    Split text into the terms of the full-text index.
+
+    Chinese has no spaces between words, so every run of CJK characters is
+    indexed as its single characters and its overlapping bigrams, other
+    words are kept whole and lowercased. A query matches on the bigrams of
+    its CJK runs, which are far more selective than single characters, and
+    only falls back to the character for runs of length one.
+    """
+    tokens = []
+    for cjk, word in _TOKEN.findall(text or ""):
+        if word:
+            tokens.append(word.lower())
+            continue
+        bigrams = [cjk[i : i + 2] for i in range(len(cjk) - 1)]
+        if query:
+            tokens += bigrams or [cjk]
+        else:
+            tokens += list(cjk) + bigrams
+    return tokens
+
 
 class SqliteConnector(SqlConnector):
-    # TODO: 多线程适配
+    # Stored in ``PRAGMA user_version``; bump it together with a new step in
+    # ``_migrate`` whenever the on-disk layout changes.
+    # 0: embeddings are pickled Python lists
+    # 1: embeddings are packed ``emb_dtype`` blobs
+    # 2: chunks carry their ``doc_id`` instead of persisted AVL tree links
+    # 3: chunk contents are indexed in the ``chunks_fts`` full-text table
+    # 4: chunks carry a ``content_hash``, duplicates link to it in ``dup_of``
+    SCHEMA_VERSION = 4
+
+    # Bound parameters per ``IN`` lookup, old SQLite builds allow 999.
+    BATCH_SIZE = 500
+
+    # Applied to every connection. WAL lets readers run next to the single
+    # writer, with ``synchronous = NORMAL`` a commit only syncs at
+    # checkpoints. The page cache is given in KiB.
+    PRAGMAS = {
+        "synchronous": "NORMAL",
+        "mmap_size": 1 << 28,
+        "cache_size": -(1 << 16),
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    }
+
+    def _connect(self) -> sqlite3.Connection:
+        # Connections are only used by one thread at a time, but may be closed
+        # from another one.
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for name, value in self.PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The calling thread's read connection."""
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = self.local.conn = self._connect()
+            with self.readers_lock:
+                self.readers.append(conn)
+        return conn
+
+    def _close(self) -> None:
+        with self.lock, self.readers_lock:
+            for conn in self.readers:
+                conn.close()
+            self.readers = []
+            self.write_conn.close()
+
     def _setup_database(self) -> None:
+        self.local = threading.local()
+        self.readers = []
+        self.readers_lock = threading.Lock()
         with self.lock:
-            self.conn = sqlite3.connect(self.db_path)
-            cursor = self.conn.cursor()
+            self.write_conn = self._connect()
+            self.write_conn.execute("PRAGMA journal_mode = WAL")
+            cursor = self.write_conn.cursor()
             cursor.execute(
                 """
                 CREATE TABLE IF NOT EXISTS chunks (
@@ -20,11 +107,10 @@ class SqliteConnector(SqlConnector):
                     content TEXT,
                     in_doc_index INTEGER,
                     embedding BLOB,
-                    parent_id INTEGER,
-                    left_child_id INTEGER,
-                    right_child_id INTEGER,
-                    FOREIGN KEY (left_child_id) REFERENCES chunks(id),
-                    FOREIGN KEY (right_child_id) REFERENCES chunks(id)
+                    doc_id INTEGER,
+                    content_hash BLOB,
+                    dup_of INTEGER,
+                    FOREIGN KEY (doc_id) REFERENCES documents(id)
                 )
                 """
             )
@@ -32,65 +118,178 @@ class SqliteConnector(SqlConnector):
                 """
                 CREATE TABLE IF NOT EXISTS documents (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chunk_id INTEGER,
-                    name TEXT,
-                    FOREIGN KEY (chunk_id) REFERENCES chunk(id)
+                    name TEXT
                 )
                 """
             )
-            self.conn.commit()
-
-    def _read_tree(self, chunk_id: int) -> DocNode:
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM chunks WHERE id = ?", (chunk_id,))
-        chunk = cursor.fetchone()
-        node = DocNode(chunk_id, chunk[2])
-        node.left = self._read_tree(chunk[5]) if chunk[5] else None
-        node.right = self._read_tree(chunk[6]) if chunk[6] else None
-        if node.left:
-            node.left.parent = node
-        if node.right:
-            node.right.paremt = node
-        return node
-
-    def read_tree(self, doc_id: int) -> DocTree:
-        cursor = self.conn.cursor()
-        chunk_id_search = cursor.execute(
-            "SELECT chunk_id FROM documents WHERE id = ?", (doc_id,)
-        ).fetchone()
-        chunk_id = chunk_id_search[0] if chunk_id_search else None
-        if not chunk_id:
-            return DocTree(doc_id)
-        root = self._read_tree(chunk_id)
-        tree = DocTree(doc_id)
-        tree.root = root
-        return tree
-
-    def _save_tree(self, node: DocNode, parent_id: int) -> None:
-        cursor = self.conn.cursor()
-        with self.lock:
             cursor.execute(
-                "UPDATE chunks SET parent_id = ?, left_child_id = ?, right_child_id = ? WHERE id = ?",
-                (
-                    parent_id if parent_id else None,
-                    node.left.id if node.left else None,
-                    node.right.id if node.right else None,
-                    node.id,
-                ),
+                """
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+                """
+            )
+            # The full-text index over ``chunks.content``, its rowid is the chunk
+            # id. It holds the terms of ``fulltext_tokens`` separated by spaces,
+            # so the tokenizer of FTS5 only has to split on them.
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5 (tokens)"
+            )
+            # The dtype is fixed when the database is created, a store opened
+            # with a different ``emb_dtype`` keeps the one it was created with.
+            cursor.execute(
+                "INSERT OR IGNORE INTO meta (key, value) VALUES ('emb_dtype', ?)",
+                (np.dtype(self.emb_dtype).name,),
+            )
+            self.emb_dtype = np.dtype(
+                cursor.execute(
+                    "SELECT value FROM meta WHERE key = 'emb_dtype'"
+                ).fetchone()[0]
             )
-            self.conn.commit()
-        if node.left:
-            self._save_tree(node.left, node.id)
-        if node.right:
-            self._save_tree(node.right, node.id)
+            self._migrate(cursor)
+            self.write_conn.commit()
 
-    def save_tree(self, tree: DocTree) -> None:
-        if tree.root.id is None:
+    def _migrate(self, cursor: sqlite3.Cursor) -> None:
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            self._migrate_pickled_embeddings(cursor)
+        if version < 2:
+            self._migrate_doc_tree(cursor)
+        if version < 3:
+            self._migrate_fulltext(cursor)
+        if version < 4:
+            self._migrate_content_hash(cursor)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS chunks_doc_index ON chunks (doc_id, in_doc_index)"
+        )
+        cursor.execute("CREATE INDEX IF NOT EXISTS documents_name ON documents (name)")
+        # Every content is stored once, its duplicates only link to it.
+        cursor.execute(
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS chunks_content_hash
+            ON chunks (content_hash) WHERE dup_of IS NULL
+            """
+        )
+        cursor.execute(
+            """
+            CREATE INDEX IF NOT EXISTS chunks_dup_of
+            ON chunks (dup_of) WHERE dup_of IS NOT NULL
+            """
+        )
+        cursor.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def _migrate_pickled_embeddings(
+        self, cursor: sqlite3.Cursor, batch_size: int = 1000
+    ) -> None:
+        last_id = 0
+        while True:
+            rows = cursor.execute(
+                "SELECT id, embedding FROM chunks WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            cursor.executemany(
+                "UPDATE chunks SET embedding = ? WHERE id = ?",
+                [(self._encode(pickle.loads(emb)), id) for id, emb in rows],
+            )
+            last_id = rows[-1][0]
+
+    def _migrate_doc_tree(self, cursor: sqlite3.Cursor) -> None:
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(chunks)")]
+        if "doc_id" in columns:
             return
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT chunk_id FROM documents WHERE id = ?", (tree.doc_id,))
-        self._save_tree(tree.root, None)
-        self.conn.commit()
+        cursor.execute("ALTER TABLE chunks ADD COLUMN doc_id INTEGER")
+        # Every document's AVL tree hangs off ``documents.chunk_id``, walk all
+        # trees at once and label their nodes with the document id.
+        rows = cursor.execute(
+            """
+            WITH RECURSIVE nodes(id, doc_id) AS (
+                SELECT chunk_id, id FROM documents WHERE chunk_id IS NOT NULL
+                UNION ALL
+                SELECT child.id, nodes.doc_id FROM nodes
+                JOIN chunks AS parent ON parent.id = nodes.id
+                JOIN chunks AS child
+                ON child.id IN (parent.left_child_id, parent.right_child_id)
+            )
+            SELECT doc_id, id FROM nodes
+            """
+        ).fetchall()
+        cursor.executemany("UPDATE chunks SET doc_id = ? WHERE id = ?", rows)
+
+    def _migrate_fulltext(self, cursor: sqlite3.Cursor, batch_size: int = 1000) -> None:
+        last_id = 0
+        while True:
+            rows = cursor.execute(
+                "SELECT id, content FROM chunks WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            cursor.executemany(
+                "INSERT INTO chunks_fts (rowid, tokens) VALUES (?, ?)",
+                [(id, " ".join(fulltext_tokens(content))) for id, content in rows],
+            )
+            last_id = rows[-1][0]
+
+    def _migrate_content_hash(
+        self, cursor: sqlite3.Cursor, batch_size: int = 1000
+    ) -> None:
+        columns = [row[1] for row in cursor.execute("PRAGMA table_info(chunks)")]
+        if "content_hash" not in columns:
+            cursor.execute("ALTER TABLE chunks ADD COLUMN content_hash BLOB")
+        if "dup_of" not in columns:
+            cursor.execute("ALTER TABLE chunks ADD COLUMN dup_of INTEGER")
+        # Duplicates that are already stored keep their embedding, they are in
+        # the embedding matrix and the index anyway.
+        first = {}
+        last_id = 0
+        while True:
+            rows = cursor.execute(
+                "SELECT id, content FROM chunks WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size),
+            ).fetchall()
+            if not rows:
+                return
+            updates = []
+            for id, content in rows:
+                key = content_hash(content)
+                updates.append((key, first.setdefault(key, id) if key else None, id))
+            cursor.executemany(
+                "UPDATE chunks SET content_hash = ?, dup_of = NULLIF(?, id) WHERE id = ?",
+                updates,
+            )
+            last_id = rows[-1][0]
+
+    def _canonical_ids(
+        self, cursor: sqlite3.Cursor, hashes: List[bytes]
+    ) -> Dict[bytes, Tuple[int, str]]:
+        """The id and content of the stored chunk of every hash that has one."""
+        hashes = list({key for key in hashes if key is not None})
+        found = {}
+        for start in range(0, len(hashes), self.BATCH_SIZE):
+            batch = hashes[start : start + self.BATCH_SIZE]
+            rows = cursor.execute(
+                f"""
+                SELECT content_hash, id, content FROM chunks
+                WHERE dup_of IS NULL AND content_hash IN ({",".join("?" * len(batch))})
+                """,
+                batch,
+            )
+            found.update((key, (id, content)) for key, id, content in rows)
+        return found
+
+    def _encode(self, embedding: List[float]) -> bytes:
+        return np.asarray(embedding, dtype=self.emb_dtype).tobytes()
+
+    def _decode(self, blob: bytes) -> np.ndarray:
+        # ``frombuffer`` shares the blob's memory, only half precision blobs are
+        # widened to float32 for the distance computations.
+        embedding = np.frombuffer(blob, dtype=self.emb_dtype)
+        if embedding.dtype != np.float32:
+            embedding = embedding.astype(np.float32)
+        return embedding
 
     def add_documents(
         self,
@@ -99,73 +298,242 @@ class SqliteConnector(SqlConnector):
         in_doc_index: List[int],
         doc_id: int = None,
         doc_name: str = None,
+        dedup: str = "link",
     ) -> int:
+        """
+        Add the chunks of a document and return the document id.
+
+        A chunk whose content is already stored, in any document or earlier
+        in the batch, is a duplicate. With ``dedup = "link"`` it is stored
+        without an embedding and with ``dup_of`` pointing at the stored
+        chunk, so it keeps its place in the document but is neither in the
+        embedding matrix nor in the full-text index. With ``"skip"`` it is
+        not stored at all.
+        """
         assert len(doc) == len(
             embedding
         ), "doc and embedding should have the same length"
+        assert dedup in ("link", "skip"), "dedup must be link or skip"
 
-        cursor = self.conn.cursor()
+        # The connection commits when the block succeeds and rolls back if it
+        # raises, the lock keeps other threads out. Worker processes share
+        # the database, so the write transaction starts before anything is
+        # read: the ids, indices and hashes read below stay current.
+        with self.lock, self.write_conn:
+            cursor = self.write_conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
 
-        if doc_id:
-            doc_exists = cursor.execute(
-                "SELECT id FROM documents WHERE id = ?", (doc_id,)
-            ).fetchone()
-            if not doc_exists:
-                raise ValueError(f"No document found with id {doc_id}")
-            avl_tree = self.read_tree(doc_id)
-        elif doc_name:
-            doc_exists = cursor.execute(
-                "SELECT id FROM documents WHERE name = ?", (doc_name,)
-            ).fetchone()
-            if doc_exists:
-                doc_id = doc_exists[0]
-                avl_tree = self.read_tree(doc_id)
+            if doc_id:
+                doc_exists = cursor.execute(
+                    "SELECT id FROM documents WHERE id = ?", (doc_id,)
+                ).fetchone()
+                if not doc_exists:
+                    raise ValueError(f"No document found with id {doc_id}")
+            elif doc_name:
+                doc_exists = cursor.execute(
+                    "SELECT id FROM documents WHERE name = ?", (doc_name,)
+                ).fetchone()
+                if doc_exists:
+                    doc_id = doc_exists[0]
+                else:
+                    cursor.execute(
+                        "INSERT INTO documents (name) VALUES (?)", (doc_name,)
+                    )
+                    doc_id = cursor.lastrowid
             else:
-                cursor.execute("INSERT INTO documents (name) VALUES (?)", (doc_name,))
-                doc_id = cursor.lastrowid
-                avl_tree = DocTree(doc_id)
-        else:
-            raise ValueError("doc_id or doc_name should be provided")
+                raise ValueError("doc_id or doc_name should be provided")
 
-        for i, (text, emb, in_doc_idx) in enumerate(zip(doc, embedding, in_doc_index)):
-            chunk_exist = cursor.execute(
-                "SELECT id FROM chunks WHERE in_doc_index = ?", (in_doc_idx,)
-            ).fetchone()
-            if chunk_exist:
-                continue
-            cursor.execute(
-                "INSERT INTO chunks (content, in_doc_index, embedding) VALUES (?, ?, ?)",
-                (text, in_doc_idx, sqlite3.Binary(pickle.dumps(emb))),
+            # Chunks whose index is already stored for this document are skipped,
+            # as are repeated indices within the batch.
+            seen = {
+                row[0]
+                for row in cursor.execute(
+                    "SELECT in_doc_index FROM chunks WHERE doc_id = ?", (doc_id,)
+                )
+            }
+            embs = np.asarray(embedding, dtype=self.emb_dtype)
+            hashes = [content_hash(text) for text in doc]
+            # Hash of every stored content to its chunk id, contents first seen
+            # in this batch map to None until they are inserted.
+            stored = {
+                key: id for key, (id, _) in self._canonical_ids(cursor, hashes).items()
+            }
+            rows, links = [], []
+            for text, emb, in_doc_idx, key in zip(doc, embs, in_doc_index, hashes):
+                if in_doc_idx in seen:
+                    continue
+                seen.add(in_doc_idx)
+                if key is not None and key in stored:
+                    if dedup == "link":
+                        links.append((text, in_doc_idx, doc_id, key))
+                    continue
+                if key is not None:
+                    stored[key] = None
+                rows.append((text, in_doc_idx, emb.tobytes(), doc_id, key))
+            # All rows go in with one executemany and a single commit. Chunk ids
+            # are AUTOINCREMENT and the transaction keeps other writers out, so
+            # the new chunks are the ones above the largest id before the insert.
+            last_id = cursor.execute(
+                "SELECT COALESCE(MAX(id), 0) FROM chunks"
+            ).fetchone()[0]
+            cursor.executemany(
+                "INSERT INTO chunks (content, in_doc_index, embedding, doc_id, content_hash) VALUES (?, ?, ?, ?, ?)",
+                rows,
             )
-            chunk_id = cursor.lastrowid
-            avl_tree.insert(chunk_id, in_doc_idx)
-
-        cursor.execute(
-            "UPDATE documents SET chunk_id = ? WHERE id = ?", (avl_tree.root.id, doc_id)
-        )
-        self.conn.commit()
-
-        self.save_tree(avl_tree)
+            ids = cursor.execute(
+                "SELECT id FROM chunks WHERE id > ? ORDER BY id", (last_id,)
+            ).fetchall()
+            cursor.executemany(
+                "INSERT INTO chunks_fts (rowid, tokens) VALUES (?, ?)",
+                [
+                    (id, " ".join(fulltext_tokens(row[0])))
+                    for (id,), row in zip(ids, rows)
+                ],
+            )
+            if links:
+                stored.update((row[4], id) for (id,), row in zip(ids, rows))
+                cursor.executemany(
+                    "INSERT INTO chunks (content, in_doc_index, doc_id, content_hash, dup_of) VALUES (?, ?, ?, ?, ?)",
+                    [link + (stored[link[3]],) for link in links],
+                )
 
         return doc_id
 
     def get_doc_id_by_chunk_id(self, chunk_id: int) -> int | None:
         cursor = self.conn.cursor()
-        root_chunk_id = chunk_id
-        continue_search = True
-        while continue_search:
-            parent_search = cursor.execute(
-                "SELECT parent_id FROM chunks WHERE id = ?", (root_chunk_id,)
-            ).fetchone()
-            if not parent_search or not parent_search[0]:
-                continue_search = False
-            else:
-                root_chunk_id = parent_search[0]
         doc_search = cursor.execute(
-            "SELECT id FROM documents WHERE chunk_id = ?", (root_chunk_id,)
+            "SELECT doc_id FROM chunks WHERE id = ?", (chunk_id,)
         ).fetchone()
         return doc_search[0] if doc_search else None
 
+    def get_doc_ids_by_chunk_ids(self, chunk_ids: List[int]) -> Dict[int, int]:
+        """Map each chunk id to its document id with a single query."""
+        if not chunk_ids:
+            return {}
+        cursor = self.conn.cursor()
+        placeholders = ",".join("?" * len(chunk_ids))
+        rows = cursor.execute(
+            f"SELECT id, doc_id FROM chunks WHERE id IN ({placeholders}) AND doc_id IS NOT NULL",
+            list(chunk_ids),
+        ).fetchall()
+        return dict(rows)
+
+    def get_doc_chunks(
+        self, doc_id: int
+    ) -> Tuple[List[int], List[int], List[str], List[int]]:
+        """
+        Return the chunk ids, in-doc indices and contents of a document ordered
+        by index, read with a single query on the (doc_id, in_doc_index) index,
+        and the ids of the chunks holding their embeddings: the chunk itself,
+        or the stored chunk a duplicate links to.
+        """
+        cursor = self.conn.cursor()
+        rows = cursor.execute(
+            """
+            SELECT id, in_doc_index, content, COALESCE(dup_of, id) FROM chunks
+            WHERE doc_id = ? ORDER BY in_doc_index
+            """,
+            (doc_id,),
+        ).fetchall()
+        if not rows:
+            return [], [], [], []
+        ids, indices, contents, emb_ids = (list(column) for column in zip(*rows))
+        return ids, indices, contents, emb_ids
+
+    def get_chunk_ids_by_docs(
+        self, doc_ids: List[int] = None, doc_names: List[str] = None
+    ) -> List[int]:
+        """Ids of all chunks of the documents with the given ids or names."""
+        doc_ids = list(doc_ids or [])
+        doc_names = list(doc_names or [])
+        if not doc_ids and not doc_names:
+            return []
+        cursor = self.conn.cursor()
+        rows = cursor.execute(
+            f"""
+            SELECT id FROM chunks WHERE doc_id IN (
+                SELECT id FROM documents
+                WHERE id IN ({",".join("?" * len(doc_ids))})
+                OR name IN ({",".join("?" * len(doc_names))})
+            )
+            ORDER BY id
+            """,
+            doc_ids + doc_names,
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def get_emb_ids_by_docs(
+        self, doc_ids: List[int] = None, doc_names: List[str] = None
+    ) -> Dict[int, int]:
+        """
+        Map the id of every chunk holding an embedding of the documents with
+        the given ids or names, the chunk itself or the stored chunk a
+        duplicate links to, to the chunk of those documents it stands for.
+        A content repeated within the documents stands for its stored chunk
+        if that is one of them, and for its oldest duplicate otherwise.
+        """
+        doc_ids = list(doc_ids or [])
+        doc_names = list(doc_names or [])
+        if not doc_ids and not doc_names:
+            return {}
+        cursor = self.conn.cursor()
+        rows = cursor.execute(
+            f"""
+            SELECT COALESCE(dup_of, id), id FROM chunks WHERE doc_id IN (
+                SELECT id FROM documents
+                WHERE id IN ({",".join("?" * len(doc_ids))})
+                OR name IN ({",".join("?" * len(doc_names))})
+            )
+            ORDER BY dup_of IS NOT NULL, id
+            """,
+            doc_ids + doc_names,
+        ).fetchall()
+        chunks = {}
+        for emb_id, id in rows:
+            chunks.setdefault(emb_id, id)
+        return chunks
+
+    def search_fulltext(
+        self,
+        query: str,
+        nums: int = 50,
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        return_scores: bool = False,
+    ) -> List[int] | List[Tuple[int, float]]:
+        """
+        Ids of the ``nums`` chunks that match any term of ``query`` best,
+        ranked by BM25. ``doc_ids`` and ``doc_names`` restrict the search to
+        the chunks of those documents, duplicates match through the stored
+        chunk they link to, whose id is returned. With ``return_scores`` every id comes
+        with its BM25 score, higher is better.
+        """
+        terms = dict.fromkeys(fulltext_tokens(query, query=True))
+        if not terms:
+            return []
+        match = " OR ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        sql = "SELECT rowid, bm25(chunks_fts) FROM chunks_fts WHERE chunks_fts MATCH ?"
+        params = [match]
+        doc_ids = list(doc_ids or [])
+        doc_names = list(doc_names or [])
+        if doc_ids or doc_names:
+            sql += f"""
+            AND rowid IN (
+                SELECT COALESCE(dup_of, id) FROM chunks WHERE doc_id IN (
+                    SELECT id FROM documents
+                    WHERE id IN ({",".join("?" * len(doc_ids))})
+                    OR name IN ({",".join("?" * len(doc_names))})
+                )
+            )
+            """
+            params += doc_ids + doc_names
+        sql += " ORDER BY bm25(chunks_fts) LIMIT ?"
+        rows = self.conn.execute(sql, params + [nums]).fetchall()
+        if return_scores:
+            # SQLite's bm25 is negated so that the best match sorts first.
+            return [(row[0], -row[1]) for row in rows]
+        return [row[0] for row in rows]
+
     def get_content_by_chunk_id(self, chunk_id: int) -> str | None:
         cursor = self.conn.cursor()
         doc_search = cursor.execute(
@@ -180,45 +548,229 @@ class SqliteConnector(SqlConnector):
         ).fetchone()
         return doc_search[0] if doc_search else None
 
-    def get_embedding_by_chunk_id(self, chunk_id: int) -> List[float] | None:
+    def get_embedding_by_chunk_id(self, chunk_id: int) -> np.ndarray | None:
         cursor = self.conn.cursor()
         embedding_search = cursor.execute(
             "SELECT embedding FROM chunks WHERE id = ?", (chunk_id,)
         ).fetchone()
-        return pickle.loads(embedding_search[0]) if embedding_search else None
+        if not embedding_search or embedding_search[0] is None:
+            return None
+        return self._decode(embedding_search[0])
 
-    def get_emb_info(self) -> List[Dict]:
+    def get_emb_matrix(self, min_id: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the ids and the embedding matrix of all chunks with an id above
+        ``min_id``, ordered by id.
+        """
         cursor = self.conn.cursor()
-        emb_info = cursor.execute("SELECT id, embedding FROM chunks").fetchall()
+        emb_info = cursor.execute(
+            """
+            SELECT id, embedding FROM chunks
+            WHERE id > ? AND embedding IS NOT NULL ORDER BY id
+            """,
+            (min_id,),
+        ).fetchall()
         if not emb_info:
-            return []
-        return [
-            {"id": info[0], "embedding": pickle.loads(info[1])} for info in emb_info
-        ]
+            return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+        ids = np.fromiter((info[0] for info in emb_info), np.int64, len(emb_info))
+        embs = np.frombuffer(
+            b"".join(info[1] for info in emb_info), dtype=self.emb_dtype
+        ).reshape(len(emb_info), -1)
+        return ids, embs.astype(np.float32, copy=False)
 
-    def get_id_by_doc(self, doc: str) -> int:
-        cursor = self.conn.cursor()
-        cursor.execute("SELECT id FROM chunks WHERE content = ?", (doc,))
-        exist = cursor.fetchone()
-        if exist is None:
-            return -1
-        return exist[0]
+    def export_tables(self, min_id: int = 0) -> Dict[str, list]:
+        """
+        Read every document and chunk in one read transaction, so the tables
+        are consistent with each other while writers go on.
 
-    def delete_by_id(self, chunk_id: int) -> bool:
-        cursor = self.conn.cursor()
-        with self.lock:
-            doc_id = self.get_doc_id_by_chunk_id(chunk_id)
-            if not doc_id:
-                return False
-            tree = self.read_tree(doc_id)
-            tree.delete(self.get_index_by_chunk_id(chunk_id))
+        The embeddings are only read for chunks with an id above ``min_id``,
+        the others are expected to be in the embedding matrix already.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            documents = conn.execute(
+                "SELECT id, name FROM documents ORDER BY id"
+            ).fetchall()
+            chunks = conn.execute(
+                "SELECT id, doc_id, in_doc_index, content, dup_of FROM chunks ORDER BY id"
+            ).fetchall()
+            embeddings = conn.execute(
+                """
+                SELECT id, embedding FROM chunks
+                WHERE id > ? AND embedding IS NOT NULL ORDER BY id
+                """,
+                (min_id,),
+            ).fetchall()
+            seq = conn.execute(
+                "SELECT seq FROM sqlite_sequence WHERE name = 'chunks'"
+            ).fetchone()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return {
+            "documents": documents,
+            "chunks": chunks,
+            "embedding_ids": [row[0] for row in embeddings],
+            "embeddings": [self._decode(row[1]) for row in embeddings],
+            "last_id": seq[0] if seq else 0,
+        }
 
-        self._save_tree(tree.root, None)
+    def import_tables(
+        self,
+        documents: List[Tuple[int, str]],
+        chunks: List[Tuple[int, int, int, str, int]],
+        embeddings: List[np.ndarray],
+        last_id: int,
+    ) -> None:
+        """
+        Bulk load the tables of an empty database in a single transaction.
 
-        with self.lock:
-            cursor.execute("DELETE FROM chunks WHERE id = ?", (chunk_id,))
+        ``chunks`` are ``(id, doc_id, in_doc_index, content, dup_of)`` rows
+        and ``embeddings`` their vectors in the same order, None for linked
+        duplicates. Chunk ids of the next inserts continue after ``last_id``.
+        """
+        with self.lock, self.write_conn:
+            cursor = self.write_conn.cursor()
+            if cursor.execute(
+                "SELECT EXISTS (SELECT 1 FROM documents) OR EXISTS (SELECT 1 FROM chunks)"
+            ).fetchone()[0]:
+                raise ValueError(f"{self.db_path} is not empty")
+            cursor.executemany(
+                "INSERT INTO documents (id, name) VALUES (?, ?)", documents
+            )
+            cursor.executemany(
+                """
+                INSERT INTO chunks
+                (id, content, in_doc_index, embedding, doc_id, content_hash, dup_of)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    (
+                        id,
+                        content,
+                        in_doc_index,
+                        None if emb is None else self._encode(emb),
+                        doc_id,
+                        content_hash(content),
+                        dup_of,
+                    )
+                    for (id, doc_id, in_doc_index, content, dup_of), emb in zip(
+                        chunks, embeddings
+                    )
+                ),
+            )
+            cursor.executemany(
+                "INSERT INTO chunks_fts (rowid, tokens) VALUES (?, ?)",
+                (
+                    (row[0], " ".join(fulltext_tokens(row[3])))
+                    for row in chunks
+                    if row[4] is None
+                ),
+            )
+            cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'chunks'")
             cursor.execute(
-                "UPDATE documents SET chunk_id = ? WHERE id = ?", (tree.root.id, doc_id)
+                "INSERT INTO sqlite_sequence (name, seq) VALUES ('chunks', ?)",
+                (max(last_id, max((row[0] for row in chunks), default=0)),),
             )
-            self.conn.commit()
-        return True
+
+    def get_id_by_doc(self, doc: str) -> int:
+        return self.get_ids_by_docs([doc])[0]
+
+    def get_ids_by_docs(self, docs: List[str]) -> List[int]:
+        """
+        The id of the stored chunk of every content, -1 for contents that are
+        not stored, looked up by content hash with one query per batch.
+        """
+        hashes = [content_hash(doc) for doc in docs]
+        stored = self._canonical_ids(self.conn.cursor(), hashes)
+        ids = []
+        for doc, key in zip(docs, hashes):
+            id, content = stored.get(key, (-1, None))
+            ids.append(id if content == doc else -1)
+        return ids
+
+    def delete_by_id(self, chunk_id: int) -> bool:
+        return chunk_id in self.delete_by_ids([chunk_id])
+
+    def delete_by_ids(self, chunk_ids: List[int]) -> List[int]:
+        """
+        Delete chunks and return the ids of the deleted ones.
+
+        The duplicates linked to a deleted chunk are kept: the oldest one that
+        is not deleted too takes over its embedding and becomes the stored
+        chunk of the content, the others link to it. It is stored again under
+        a new id, since chunk ids only grow, and keeps its document and index.
+        Its old id is returned with the deleted ones, duplicates of databases
+        written before deduplication still have an embedding under it.
+        """
+        chunk_ids = list(chunk_ids)
+        deleted, linked = [], []
+        with self.lock, self.write_conn:
+            cursor = self.write_conn.cursor()
+            for start in range(0, len(chunk_ids), self.BATCH_SIZE):
+                batch = chunk_ids[start : start + self.BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                ids = [
+                    row[0]
+                    for row in cursor.execute(
+                        f"SELECT id FROM chunks WHERE id IN ({placeholders})", batch
+                    )
+                ]
+                if not ids:
+                    continue
+                placeholders = ",".join("?" * len(ids))
+                linked += cursor.execute(
+                    f"""
+                    SELECT id, embedding FROM chunks
+                    WHERE id IN ({placeholders}) AND dup_of IS NULL
+                    AND EXISTS (SELECT 1 FROM chunks AS dup WHERE dup.dup_of = chunks.id)
+                    """,
+                    ids,
+                ).fetchall()
+                cursor.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", ids)
+                cursor.execute(
+                    f"DELETE FROM chunks_fts WHERE rowid IN ({placeholders})", ids
+                )
+                deleted += ids
+            # Duplicates are promoted once every requested chunk is deleted, so
+            # that a duplicate deleted in the same call is never promoted.
+            for id, embedding in linked:
+                old_id = self._promote_duplicate(cursor, id, embedding)
+                if old_id is not None:
+                    deleted.append(old_id)
+        return sorted(deleted)
+
+    def _promote_duplicate(
+        self, cursor: sqlite3.Cursor, chunk_id: int, embedding: bytes
+    ) -> int | None:
+        """
+        Store the oldest duplicate linked to the deleted chunk ``chunk_id``
+        again under a new id with ``embedding``, and link the others to it.
+        Returns the old id of the duplicate, None if there was none.
+        """
+        row = cursor.execute(
+            """
+            SELECT id, content, in_doc_index, doc_id, content_hash FROM chunks
+            WHERE dup_of = ? ORDER BY id LIMIT 1
+            """,
+            (chunk_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        id, content, in_doc_index, doc_id, key = row
+        cursor.execute("DELETE FROM chunks WHERE id = ?", (id,))
+        cursor.execute("DELETE FROM chunks_fts WHERE rowid = ?", (id,))
+        cursor.execute(
+            "INSERT INTO chunks (content, in_doc_index, embedding, doc_id, content_hash) VALUES (?, ?, ?, ?, ?)",
+            (content, in_doc_index, embedding, doc_id, key),
+        )
+        new_id = cursor.lastrowid
+        cursor.execute(
+            "UPDATE chunks SET dup_of = ? WHERE dup_of = ?", (new_id, chunk_id)
+        )
+        cursor.execute(
+            "INSERT INTO chunks_fts (rowid, tokens) VALUES (?, ?)",
+            (new_id, " ".join(fulltext_tokens(content))),
+        )
+        return id
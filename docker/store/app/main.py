@@ -1,7 +1,14 @@
-from typing import List
-from fastapi import FastAPI
+from typing import Dict, List, Optional
+import os
+import tarfile
+import tempfile
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse
 from pydantic import BaseModel
-from EmbeddingStore.AnnStore import AnnoyStore
+from starlette.background import BackgroundTask
+from EmbeddingStore.AnnStore import SearchHit
+from EmbeddingStore.StoreManager import StoreManager
 
 
 class DocEmbs(BaseModel):
@@ -17,6 +24,29 @@ class SearchParams(BaseModel):
     query_vec: List[float]
     num: int = 50
     store_name: str = "store"
+    doc_ids: Optional[List[int]] = None
+    doc_names: Optional[List[str]] = None
+    return_text: bool = True
+
+
+class BatchSearchParams(BaseModel):
+    query_vecs: List[List[float]]
+    num: int = 50
+    store_name: str = "store"
+    doc_ids: Optional[List[int]] = None
+    doc_names: Optional[List[str]] = None
+    return_text: bool = True
+
+
+class HybridSearchParams(BaseModel):
+    query_text: str
+    query_vec: List[float]
+    num: int = 50
+    store_name: str = "store"
+    doc_ids: Optional[List[int]] = None
+    doc_names: Optional[List[str]] = None
+    return_text: bool = True
+    rrf_k: int = 60
 
 
 class Docs(BaseModel):
@@ -30,6 +60,20 @@ class Ids(BaseModel):
 
 
 app = FastAPI()
+stores = StoreManager()
+
+
+def _search_results(hits: List[SearchHit], return_text: bool) -> Dict[str, list]:
+    res = {
+        "scores": [hit.score for hit in hits],
+        "distances": [hit.distance for hit in hits],
+        "chunk_ids": [hit.chunk_id for hit in hits],
+        "merged_chunk_ids": [hit.chunk_ids for hit in hits],
+        "doc_ids": [hit.doc_id for hit in hits],
+    }
+    if return_text:
+        res["knowledges"] = [hit.text for hit in hits]
+    return res
 
 
 @app.post("/ann/add_docs")
@@ -40,14 +84,14 @@ def add_document(req: DocEmbs):
     doc_name = req.doc_name
     doc_id = req.doc_id
     store_name = req.store_name
-    store = AnnoyStore(store_name=store_name)
-    store.add_documents(
-        doc_list=doc_list,
-        doc_emb_list=doc_emb_list,
-        doc_index=doc_index,
-        doc_name=doc_name,
-        doc_id=doc_id,
-    )
+    with stores.use(store_name) as store:
+        store.add_documents(
+            doc_list=doc_list,
+            doc_emb_list=doc_emb_list,
+            doc_index=doc_index,
+            doc_name=doc_name,
+            doc_id=doc_id,
+        )
 
 
 @app.post("/ann/search")
@@ -55,19 +99,61 @@ def search_by_embedding(req: SearchParams):
     query_vec = req.query_vec
     num = req.num
     store_name = req.store_name
-    store = AnnoyStore(store_name=store_name)
-    res = store.search_by_embedding(query_vec, num)
-    return {"knowledges": res}
+    with stores.use(store_name) as store:
+        res = store.search_by_embedding(
+            query_vec,
+            num,
+            doc_ids=req.doc_ids,
+            doc_names=req.doc_names,
+            return_hits=True,
+        )
+    return _search_results(res, req.return_text)
+
+
+@app.post("/ann/search_batch")
+def search_by_embeddings(req: BatchSearchParams):
+    query_vecs = req.query_vecs
+    num = req.num
+    store_name = req.store_name
+    with stores.use(store_name) as store:
+        res = store.search_by_embeddings(
+            query_vecs,
+            num,
+            doc_ids=req.doc_ids,
+            doc_names=req.doc_names,
+            return_hits=True,
+        )
+    results = [_search_results(hits, req.return_text) for hits in res]
+    return {
+        key: [result[key] for result in results]
+        for key in _search_results([], req.return_text)
+    }
+
+
+@app.post("/ann/hybrid_search")
+def hybrid_search(req: HybridSearchParams):
+    with stores.use(req.store_name) as store:
+        res = store.hybrid_search_by_embedding(
+            req.query_text,
+            req.query_vec,
+            req.num,
+            doc_ids=req.doc_ids,
+            doc_names=req.doc_names,
+            rrf_k=req.rrf_k,
+            return_hits=True,
+        )
+    results = _search_results(res, req.return_text)
+    results["rrf_scores"] = [hit.rrf_score for hit in res]
+    results["bm25_scores"] = [hit.bm25_score for hit in res]
+    return results
 
 
 @app.post("/ann/get_ids")
 def get_id_by_docs(req: Docs):
     docs = req.docs
     store_name = req.store_name
-    store = AnnoyStore(store_name=store_name)
-    ids = []
-    for doc in docs:
-        ids.append(store.get_id_by_doc(doc))
+    with stores.use(store_name) as store:
+        ids = store.get_ids_by_docs(docs)
     return {"ids": ids}
 
 
@@ -75,6 +161,47 @@ def get_id_by_docs(req: Docs):
 def delete_by_ids(req: Ids):
     ids = req.ids
     store_name = req.store_name
-    store = AnnoyStore(store_name=store_name)
-    for id in ids:
-        store.delete_by_id(id)
+    with stores.use(store_name) as store:
+        store.delete_by_ids(ids)
+
+
+@app.get("/ann/export")
+def export_snapshot(store_name: str = "store"):
+    fd, path = tempfile.mkstemp(suffix=".tar")
+    os.close(fd)
+    try:
+        with stores.use(store_name) as store:
+            store.export_snapshot(path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return FileResponse(
+        path,
+        media_type="application/x-tar",
+        filename=f"{store_name}.tar",
+        background=BackgroundTask(os.remove, path),
+    )
+
+
+def _import_snapshot(store_name: str, path: str) -> None:
+    with stores.use(store_name) as store:
+        store.import_snapshot(path)
+
+
+@app.post("/ann/import")
+async def import_snapshot(request: Request, store_name: str = "store"):
+    # The archive is streamed to disk, it can be far larger than the memory.
+    with tempfile.NamedTemporaryFile(suffix=".tar", delete=False) as f:
+        async for chunk in request.stream():
+            f.write(chunk)
+    try:
+        await run_in_threadpool(_import_snapshot, store_name, f.name)
+    except (ValueError, tarfile.TarError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.remove(f.name)
+
+
+@app.get("/ann/stats")
+def get_stats():
+    return stores.stats()
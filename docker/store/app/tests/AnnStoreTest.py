@@ -0,0 +1,33 @@
+import sys
+import os
+import tempfile
+import numpy as np
+
+sys.path.append(f"{sys.path[0]}/../")
+
+from EmbeddingStore.AnnStore import AnnoyStore
+
+rng = np.random.default_rng(0)
+embs = rng.normal(size=(3, 8)).tolist()
+
+with tempfile.TemporaryDirectory() as tmp:
+    store = AnnoyStore(
+        index_path=os.path.join(tmp, "test.ann"),
+        db_path=os.path.join(tmp, "test.db"),
+        emb_len=8,
+    )
+    contents = ["The first chunk", "The second chunk", "The third chunk"]
+    store.add_documents(contents, embs, [0, 1, 2], doc_name="A")
+    # Every chunk of B repeats a chunk of A and is only linked to it.
+    store.add_documents(contents[:2], embs[:2], [0, 1], doc_name="B")
+
+    hits = store.search_by_embedding(embs[0], 3, doc_names=["B"], return_hits=True)
+    b_ids = store._connector().get_chunk_ids_by_docs(doc_names=["B"])
+    if hits and all(hit.chunk_id in b_ids for hit in hits):
+        print("Searching a linked document returns its own chunks")
+
+    hits = store.hybrid_search_by_embedding(
+        "second", embs[1], 3, doc_names=["B"], return_hits=True
+    )
+    if hits and hits[0].chunk_id in b_ids and hits[0].bm25_score is not None:
+        print("Hybrid search finds the keyword in the linked document")
@@ -0,0 +1,49 @@
+import sys
+import os
+import tempfile
+import numpy as np
+
+sys.path.append(f"{sys.path[0]}/../")
+
+from EmbeddingStore.EmbeddingMatrix import EmbeddingMatrix
+from EmbeddingStore.IvfBackend import IvfBackend
+from EmbeddingStore.IvfPqBackend import IvfPqBackend
+from EmbeddingStore.IvfSqBackend import IvfSqBackend
+
+# Clustered vectors, so that the coarse quantizer has structure to find.
+rng = np.random.default_rng(0)
+emb_len, n = 64, 20000
+centers = rng.normal(size=(200, emb_len))
+embs = (centers[rng.integers(0, 200, n)] + 0.5 * rng.normal(size=(n, emb_len))).astype(
+    np.float32
+)
+queries = (
+    centers[rng.integers(0, 200, 100)] + 0.5 * rng.normal(size=(100, emb_len))
+).astype(np.float32)
+ids = np.arange(1, n + 1)
+
+matrix = EmbeddingMatrix(os.path.join(tempfile.mkdtemp(), "test.emb.npy"), emb_len)
+matrix.append(ids, embs)
+
+normed = embs / np.linalg.norm(embs, axis=1, keepdims=True)
+truth = [set((np.argsort(-(normed @ query))[:10] + 1).tolist()) for query in queries]
+
+for index in (
+    IvfBackend(emb_len, "angular", matrix),
+    IvfPqBackend(emb_len, "angular", matrix, rerank=1),
+    IvfPqBackend(emb_len, "angular", matrix),
+    IvfSqBackend(emb_len, "angular", matrix, rerank=1),
+    IvfSqBackend(emb_len, "angular", matrix),
+):
+    index.build(ids, embs)
+    recall = np.mean(
+        [
+            len(set(index.search(query, 10)[0]) & expected) / 10
+            for query, expected in zip(queries, truth)
+        ]
+    )
+    code_size = getattr(index, "code_size", emb_len * 4 + 8)
+    print(
+        f"{type(index).__name__} rerank={getattr(index, 'rerank', '-')}: "
+        f"recall@10 {recall:.3f}, {code_size} bytes per vector"
+    )
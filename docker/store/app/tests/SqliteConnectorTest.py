@@ -1,34 +1,83 @@
 import sys
 import os
+import tempfile
 
 sys.path.append(f"{sys.path[0]}/../")
 
 from SqlConnector import SqliteConnector
-from DocTree import DocTree
 
-connector = SqliteConnector(
-    os.path.join(os.path.dirname(__file__), "..", "data", "test.db")
-)
+with tempfile.TemporaryDirectory() as tmp:
+    connector = SqliteConnector(os.path.join(tmp, "test.db"))
 
-doc_id = connector.add_documents(
-    ["This is a test document"], [[0.1, 0.2, 0.3, 0.4, 0.5]], [0], doc_name="test"
-)
+    doc_id = connector.add_documents(
+        ["This is a test document"], [[0.1, 0.2, 0.3, 0.4, 0.5]], [0], doc_name="test"
+    )
 
-connector.add_documents(
-    ["This is another test document"], [[0.1, 0.2, 0.3, 0.4, 0.5]], [1], doc_name="test"
-)
+    connector.add_documents(
+        ["This is another test document"],
+        [[0.1, 0.2, 0.3, 0.4, 0.5]],
+        [1],
+        doc_name="test",
+    )
 
-connector.add_documents(
-    ["This is the third test document"],
-    [[0.1, 0.2, 0.3, 0.4, 0.5]],
-    [2],
-    doc_name="test",
-)
+    connector.add_documents(
+        ["This is the third test document"],
+        [[0.1, 0.2, 0.3, 0.4, 0.5]],
+        [2],
+        doc_name="test",
+    )
 
-connector.delete_by_id(1)
+    ids, indices, contents, _ = connector.get_doc_chunks(doc_id)
+    connector.delete_by_id(ids[0])
 
-avl1 = DocTree(doc_id)
-avl2 = connector.read_tree(doc_id)
+    new_ids, new_indices, new_contents, _ = connector.get_doc_chunks(doc_id)
 
-if avl1 is avl2:
-    print("The trees are the same")
+    if new_ids == ids[1:] and new_indices == indices[1:]:
+        print("The first chunk is deleted and the others keep their order")
+
+    other_id = connector.add_documents(
+        ["This is another test document", "This is a chunk of another document"],
+        [[0.1, 0.2, 0.3, 0.4, 0.5], [0.5, 0.4, 0.3, 0.2, 0.1]],
+        [0, 1],
+        doc_name="other",
+    )
+
+    ids, indices, contents, emb_ids = connector.get_doc_chunks(other_id)
+
+    if emb_ids == [new_ids[0], ids[1]]:
+        print("The duplicate is kept in its document and links to the stored chunk")
+
+    connector.delete_by_id(new_ids[0])
+
+    new_ids, new_indices, new_contents, new_emb_ids = connector.get_doc_chunks(other_id)
+
+    if (
+        new_contents == contents
+        and new_emb_ids == new_ids
+        and connector.get_id_by_doc(contents[0]) == new_ids[0]
+        and connector.get_embedding_by_chunk_id(new_ids[0]) is not None
+    ):
+        print("Deleting the stored chunk promotes its duplicate")
+
+    # A duplicate written before deduplication still has its embedding and FTS row.
+    connector.add_documents(
+        ["This is a legacy chunk"], [[0.2, 0.2, 0.2, 0.2, 0.2]], [0], doc_name="legacy"
+    )
+    stored_id = connector.get_id_by_doc("This is a legacy chunk")
+    with connector.write_conn:
+        old_id = connector.write_conn.execute(
+            "INSERT INTO chunks (content, in_doc_index, embedding, doc_id, content_hash, dup_of) SELECT content, 1, embedding, doc_id, content_hash, id FROM chunks WHERE id = ?",
+            (stored_id,),
+        ).lastrowid
+        connector.write_conn.execute(
+            "INSERT INTO chunks_fts (rowid, tokens) SELECT ?, tokens FROM chunks_fts WHERE rowid = ?",
+            (old_id, stored_id),
+        )
+
+    deleted = connector.delete_by_ids([stored_id])
+    fts_rows = connector.conn.execute(
+        "SELECT COUNT(*) FROM chunks_fts WHERE rowid = ?", (old_id,)
+    ).fetchone()[0]
+
+    if deleted == [stored_id, old_id] and fts_rows == 0:
+        print("Promoting a duplicate deletes its old id")
@@ -1 +1,2 @@
-from .ann_store import AnnStore
\ No newline at end of file
+from .ann_store import AnnStore
+from .sharded_ann_store import ShardedAnnStore
@@ -6,6 +6,17 @@ from langchain_core.documents import Document
 
 
 class AnnStore(Store):
+    # Per result fields of the search endpoints, kept in ``Document.metadata``.
+    RESULT_FIELDS = {
+        "scores": "score",
+        "distances": "distance",
+        "chunk_ids": "chunk_id",
+        "merged_chunk_ids": "merged_chunk_ids",
+        "doc_ids": "doc_id",
+        "rrf_scores": "rrf_score",
+        "bm25_scores": "bm25_score",
+    }
+
     def __init__(self, router_path: str, port: str) -> None:
         super().__init__()
         self.router_path = router_path
@@ -46,22 +57,106 @@ class AnnStore(Store):
             )
         return True
 
+    def _documents(self, results: dict) -> List[Document]:
+        """The documents of one query from the parallel lists of a search result."""
+        fields = {
+            key: results[field]
+            for field, key in self.RESULT_FIELDS.items()
+            if field in results
+        }
+        knowledges = results.get("knowledges", [""] * len(results["scores"]))
+        return [
+            Document(
+                page_content=knowledge,
+                metadata={key: values[i] for key, values in fields.items()},
+            )
+            for i, knowledge in enumerate(knowledges)
+        ]
+
     def search_by_embed(
-        self, query_embed: List[float], k: int = 10, store_name: str = "store"
+        self,
+        query_embed: List[float],
+        k: int = 10,
+        store_name: str = "store",
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        return_text: bool = True,
     ) -> List[Document]:
         super().search_by_embed(query_embed)
         result = requests.post(
             url=f"{self.request_url}/ann/search",
-            json={"query_vec": query_embed, "num": k, "store_name": store_name},
+            json={
+                "query_vec": query_embed,
+                "num": k,
+                "store_name": store_name,
+                "doc_ids": doc_ids,
+                "doc_names": doc_names,
+                "return_text": return_text,
+            },
         )
         if result.status_code != 200:
             raise ValueError(
                 f"Error in search by embedding from {self.request_url} with status code {result.status_code} : {result.text}"
             )
-        results = result.json()["knowledges"]
+        return self._documents(result.json())
+
+    def search_by_embeds(
+        self,
+        query_embeds: List[List[float]],
+        k: int = 10,
+        store_name: str = "store",
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        return_text: bool = True,
+    ) -> List[List[Document]]:
+        result = requests.post(
+            url=f"{self.request_url}/ann/search_batch",
+            json={
+                "query_vecs": query_embeds,
+                "num": k,
+                "store_name": store_name,
+                "doc_ids": doc_ids,
+                "doc_names": doc_names,
+                "return_text": return_text,
+            },
+        )
+        if result.status_code != 200:
+            raise ValueError(
+                f"Error in batch search by embedding from {self.request_url} with status code {result.status_code} : {result.text}"
+            )
+        results = result.json()
         return [
-            Document(page_content=knowledge) for knowledge in results
-        ]  # 这里对Document的构造还需要再测试一下
+            self._documents({field: values[i] for field, values in results.items()})
+            for i in range(len(query_embeds))
+        ]
+
+    def hybrid_search_by_embed(
+        self,
+        query: str,
+        query_embed: List[float],
+        k: int = 10,
+        store_name: str = "store",
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        return_text: bool = True,
+    ) -> List[Document]:
+        result = requests.post(
+            url=f"{self.request_url}/ann/hybrid_search",
+            json={
+                "query_text": query,
+                "query_vec": query_embed,
+                "num": k,
+                "store_name": store_name,
+                "doc_ids": doc_ids,
+                "doc_names": doc_names,
+                "return_text": return_text,
+            },
+        )
+        if result.status_code != 200:
+            raise ValueError(
+                f"Error in hybrid search from {self.request_url} with status code {result.status_code} : {result.text}"
+            )
+        return self._documents(result.json())
 
     def get_id_by_docs(
         self, docs: List[Document], store_name: str = "store"
@@ -18,6 +18,13 @@ class Store(ABC):
     def search_by_embed(self, query_embed: List[List[float]]) -> List[Document]:
         pass
 
+    def search_by_embeds(
+        self, query_embeds: List[List[float]], **kwargs
+    ) -> List[List[Document]]:
+        return [
+            self.search_by_embed(query_embed, **kwargs) for query_embed in query_embeds
+        ]
+
     @abstractmethod
     def get_id_by_docs(self, docs: List[Document]) -> List[int]:
         pass
@@ -0,0 +1,238 @@
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from langchain_core.documents import Document
+
+from .base import Store
+from .ann_store import AnnStore
+
+
+class ShardedAnnStore(Store):
+    """
+    A store partitioned across several store services.
+
+    Every document lives on one shard, picked by a hash of its name, so the
+    neighbour merge of a hit never needs chunks of another shard. Searches
+    are sent to all shards in parallel and their results merged by score.
+    Hybrid results are fused again across the shards, see ``_fuse``.
+
+    Ids are local to a shard, the ids this store hands out and accepts are
+    global: ``local_id * len(shards) + shard``.
+    """
+
+    # The ``rrf_k`` of the store services' hybrid search.
+    RRF_K = 60
+
+    def __init__(self, shards: List[Dict[str, str]]) -> None:
+        super().__init__()
+        assert shards, "at least one shard should be provided"
+        self.shards = [
+            AnnStore(shard["router_path"], shard["port"]) for shard in shards
+        ]
+        self.executor = ThreadPoolExecutor(max_workers=len(self.shards))
+        return
+
+    def _shard_of_name(self, doc_name: str) -> int:
+        # ``hash`` of a str changes between processes, crc32 does not.
+        return zlib.crc32(doc_name.encode("utf-8")) % len(self.shards)
+
+    def _split_id(self, global_id: int) -> Tuple[int, int]:
+        return global_id % len(self.shards), global_id // len(self.shards)
+
+    def _global_id(self, shard: int, local_id: int) -> int:
+        return local_id * len(self.shards) + shard
+
+    def add_documents(
+        self,
+        documents: List[Document],
+        doc_embeds: List[List[float]],
+        doc_index: List[int],
+        doc_name: str = None,
+        doc_id: int = None,
+        store_name: str = "store",
+    ) -> bool:
+        assert (
+            doc_name is not None or doc_id is not None
+        ), "doc_name or doc_id should be provided"
+        if doc_id is not None:
+            shard, doc_id = self._split_id(doc_id)
+        else:
+            shard = self._shard_of_name(doc_name)
+        return self.shards[shard].add_documents(
+            documents, doc_embeds, doc_index, doc_name, doc_id, store_name
+        )
+
+    def _filters(self, doc_ids: List[int], doc_names: List[str]) -> List[Dict]:
+        """
+        The document filter of every shard, or None for shards that hold none
+        of the filtered documents.
+        """
+        if not doc_ids and not doc_names:
+            return [{"doc_ids": None, "doc_names": None} for _ in self.shards]
+        filters = [{"doc_ids": [], "doc_names": []} for _ in self.shards]
+        for doc_id in doc_ids or []:
+            shard, local_id = self._split_id(doc_id)
+            filters[shard]["doc_ids"].append(local_id)
+        for doc_name in doc_names or []:
+            filters[self._shard_of_name(doc_name)]["doc_names"].append(doc_name)
+        return [
+            (
+                shard_filter
+                if shard_filter["doc_ids"] or shard_filter["doc_names"]
+                else None
+            )
+            for shard_filter in filters
+        ]
+
+    def _globalize(self, shard: int, docs: List[Document]) -> List[Document]:
+        """Replace the local ids in the metadata of a shard's results."""
+        for doc in docs:
+            metadata = doc.metadata
+            for key in ("chunk_id", "doc_id"):
+                if metadata.get(key) is not None:
+                    metadata[key] = self._global_id(shard, metadata[key])
+            if metadata.get("merged_chunk_ids") is not None:
+                metadata["merged_chunk_ids"] = [
+                    self._global_id(shard, id) for id in metadata["merged_chunk_ids"]
+                ]
+        return docs
+
+    @staticmethod
+    def _merge(results: List[List[Document]], k: int) -> List[Document]:
+        docs = [doc for result in results for doc in result]
+        docs.sort(key=lambda doc: doc.metadata.get("score") or 0.0, reverse=True)
+        return docs[:k]
+
+    @staticmethod
+    def _fuse(results: List[List[Document]], k: int, rrf_k: int) -> List[Document]:
+        """
+        The ``k`` best hybrid results of all shards by reciprocal-rank fusion.
+
+        The fused scores of the shards rank every hit within its own shard
+        only, the best hit of every shard has the same score. The hits of all
+        shards are ranked again by their distance and by their BM25 score,
+        and these rankings are fused like a single store fuses its own, which
+        sets ``rrf_score`` to the fused score across the shards.
+        """
+        docs = [doc for result in results for doc in result]
+        dense = sorted(docs, key=lambda doc: doc.metadata["distance"])[:k]
+        text = sorted(
+            (doc for doc in docs if doc.metadata.get("bm25_score") is not None),
+            key=lambda doc: -doc.metadata["bm25_score"],
+        )[:k]
+        scores = {}
+        for ranking in (dense, text):
+            for rank, doc in enumerate(ranking, 1):
+                scores[id(doc)] = scores.get(id(doc), 0.0) + 1.0 / (rrf_k + rank)
+        fused = {id(doc): doc for ranking in (dense, text) for doc in ranking}
+        best = sorted(scores, key=lambda doc_id: -scores[doc_id])[:k]
+        for doc_id in best:
+            fused[doc_id].metadata["rrf_score"] = scores[doc_id]
+        return [fused[doc_id] for doc_id in best]
+
+    def _scatter(
+        self, search, doc_ids: List[int], doc_names: List[str]
+    ) -> List[Tuple[int, object]]:
+        """
+        Call ``search(shard, doc_ids, doc_names)`` on every shard that can hold
+        a hit in parallel, and return the index and result of those shards.
+        """
+        futures = [
+            (i, self.executor.submit(search, shard, **shard_filter))
+            for i, (shard, shard_filter) in enumerate(
+                zip(self.shards, self._filters(doc_ids, doc_names))
+            )
+            if shard_filter is not None
+        ]
+        return [(i, future.result()) for i, future in futures]
+
+    def search_by_embed(
+        self,
+        query_embed: List[float],
+        k: int = 10,
+        store_name: str = "store",
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        return_text: bool = True,
+    ) -> List[Document]:
+        results = self._scatter(
+            lambda shard, **kwargs: shard.search_by_embed(
+                query_embed, k, store_name, return_text=return_text, **kwargs
+            ),
+            doc_ids,
+            doc_names,
+        )
+        return self._merge([self._globalize(i, docs) for i, docs in results], k)
+
+    def search_by_embeds(
+        self,
+        query_embeds: List[List[float]],
+        k: int = 10,
+        store_name: str = "store",
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        return_text: bool = True,
+    ) -> List[List[Document]]:
+        results = self._scatter(
+            lambda shard, **kwargs: shard.search_by_embeds(
+                query_embeds, k, store_name, return_text=return_text, **kwargs
+            ),
+            doc_ids,
+            doc_names,
+        )
+        return [
+            self._merge(
+                [self._globalize(shard, result[i]) for shard, result in results], k
+            )
+            for i in range(len(query_embeds))
+        ]
+
+    def hybrid_search_by_embed(
+        self,
+        query: str,
+        query_embed: List[float],
+        k: int = 10,
+        store_name: str = "store",
+        doc_ids: List[int] = None,
+        doc_names: List[str] = None,
+        return_text: bool = True,
+    ) -> List[Document]:
+        results = self._scatter(
+            lambda shard, **kwargs: shard.hybrid_search_by_embed(
+                query, query_embed, k, store_name, return_text=return_text, **kwargs
+            ),
+            doc_ids,
+            doc_names,
+        )
+        return self._fuse(
+            [self._globalize(i, docs) for i, docs in results], k, self.RRF_K
+        )
+
+    def get_id_by_docs(
+        self, docs: List[Document], store_name: str = "store"
+    ) -> List[int]:
+        super().get_id_by_docs(docs)
+        results = self._scatter(
+            lambda shard, **kwargs: shard.get_id_by_docs(docs, store_name), None, None
+        )
+        ids = [-1] * len(docs)
+        for shard, shard_ids in results:
+            for i, local_id in enumerate(shard_ids):
+                if ids[i] == -1 and local_id != -1:
+                    ids[i] = self._global_id(shard, local_id)
+        return ids
+
+    def delete_documents_by_ids(
+        self, doc_ids: List[int], store_name: str = "store"
+    ) -> bool:
+        super().delete_documents_by_ids(doc_ids)
+        local_ids = [[] for _ in self.shards]
+        for doc_id in doc_ids:
+            shard, local_id = self._split_id(doc_id)
+            local_ids[shard].append(local_id)
+        futures = [
+            self.executor.submit(shard.delete_documents_by_ids, ids, store_name)
+            for shard, ids in zip(self.shards, local_ids)
+            if ids
+        ]
+        return all(future.result() for future in futures)